@@ -1,237 +1,2150 @@
-import PyPDF2
+import abc
+import argparse
+import bisect
 import re
+import collections
+import contextlib
 import csv
-from typing import List, Dict, Tuple
-import spacy
+import functools
+import glob
+import hashlib
+import itertools
+import importlib.util
+import json
+import logging
+import os
+import pickle
+import sys
+import time
 import warnings
-warnings.filterwarnings('ignore')
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """Extract text content from PDF file."""
-    text = ""
-    try:
+# Library diagnostics; silent unless the application configures logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Progress callback: (stage, done, total)
+ProgressCallback = Callable[[str, int, int], None]
+
+class ExtractionMetrics:
+    """Stage timers and counters collected while extracting entities.
+    
+    Timers accumulate wall-clock seconds per stage; counters track PANs
+    found, how each was linked (pattern, dictionary, NER, broader window)
+    or left unmatched, and how much text spaCy processed.
+    """
+    
+    def __init__(self):
+        self.timers = collections.defaultdict(float)
+        self.counters = collections.defaultdict(int)
+    
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Time the enclosed block, adding to the named stage's total."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] += time.perf_counter() - start
+    
+    def increment(self, name: str, value: int = 1):
+        self.counters[name] += value
+    
+    def merge(self, other: Dict):
+        """Add the timers and counters of another to_dict() snapshot."""
+        for name, seconds in other.get('timers_seconds', {}).items():
+            self.timers[name] += seconds
+        for name, value in other.get('counters', {}).items():
+            self.counters[name] += value
+    
+    def to_dict(self) -> Dict:
+        return {'timers_seconds': dict(self.timers), 'counters': dict(self.counters)}
+    
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+    
+    def to_prometheus(self, prefix: str = "pan_extraction") -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        lines = [f"# TYPE {prefix}_stage_seconds counter"]
+        for name, seconds in sorted(self.timers.items()):
+            lines.append(f'{prefix}_stage_seconds{{stage="{name}"}} {seconds:.6f}')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+    
+    def dump(self, path: str):
+        """Write the metrics to a file: Prometheus text for .prom/.txt, JSON otherwise."""
+        as_prometheus = path.endswith(('.prom', '.txt'))
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(self.to_prometheus() if as_prometheus else self.to_json())
+
+class PdfText(NamedTuple):
+    """Extracted document text with the (start, end) character span of each page.
+    
+    complete is False when reading stopped on an error partway through.
+    """
+    text: str
+    page_offsets: List[Tuple[int, int]]
+    complete: bool = True
+
+# Minimum seconds between two page progress updates
+PROGRESS_INTERVAL = 0.5
+
+def build_page_offsets(pages: List[str]) -> List[Tuple[int, int]]:
+    """Compute each page's character span in the newline-joined document text."""
+    offsets = []
+    position = 0
+    for page in pages:
+        offsets.append((position, position + len(page)))
+        position += len(page) + 1
+    return offsets
+
+def page_at_offset(page_offsets: List[Tuple[int, int]], offset: int) -> int:
+    """Return the 1-based page number containing a character offset."""
+    return max(1, bisect.bisect_right(page_offsets, (offset, sys.maxsize)))
+
+class PdfBackend(abc.ABC):
+    """Text extraction library behind iter_pdf_pages; subclasses wrap one library each.
+    
+    Libraries are imported on first use, so optional backends cost nothing
+    unless selected.
+    """
+    
+    name = ''
+    module = ''  # Import name, for checking whether the library is installed
+    requirement = ''  # Distribution name to pip install
+    
+    @abc.abstractmethod
+    def page_count(self, pdf_path: str) -> int:
+        """Number of pages in the PDF."""
+    
+    @abc.abstractmethod
+    def iter_pages(self, pdf_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+        """Yield the text of pages [start, end) in order."""
+
+class PyPDF2Backend(PdfBackend):
+    """Pure-Python extraction with PyPDF2, the default."""
+    
+    name = 'pypdf2'
+    module = 'PyPDF2'
+    requirement = 'PyPDF2'
+    
+    def page_count(self, pdf_path: str) -> int:
+        import PyPDF2
+        
         with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            print(f"  Total pages: {len(pdf_reader.pages)}")
-            for i, page in enumerate(pdf_reader.pages, 1):
-                print(f"  Processing page {i}...", end='\r')
-                text += page.extract_text() + "\n"
+            return len(PyPDF2.PdfReader(file).pages)
+    
+    def iter_pages(self, pdf_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+        import PyPDF2
+        
+        with open(pdf_path, 'rb') as file:
+            pages = PyPDF2.PdfReader(file).pages
+            for i in range(start, len(pages) if end is None else end):
+                yield pages[i].extract_text()
+
+class PdfiumBackend(PdfBackend):
+    """Extraction with pypdfium2, bindings to the PDFium engine used by Chrome."""
+    
+    name = 'pypdfium2'
+    module = 'pypdfium2'
+    requirement = 'pypdfium2'
+    
+    def page_count(self, pdf_path: str) -> int:
+        import pypdfium2
+        
+        pdf = pypdfium2.PdfDocument(pdf_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    
+    def iter_pages(self, pdf_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+        import pypdfium2
+        
+        pdf = pypdfium2.PdfDocument(pdf_path)
+        try:
+            for i in range(start, len(pdf) if end is None else end):
+                page = pdf[i]
+                try:
+                    text_page = page.get_textpage()
+                    try:
+                        # PDFium ends lines with CRLF
+                        text = text_page.get_text_range().replace('\r\n', '\n')
+                    finally:
+                        text_page.close()
+                finally:
+                    page.close()
+                yield text
+        finally:
+            pdf.close()
+
+# pdfminer.six layout analysis tuned for speed: boxes_flow=None skips the
+# costly ordering of text boxes, and vertical text detection is off
+PDFMINER_LAPARAMS = {'line_margin': 0.5, 'char_margin': 2.0, 'word_margin': 0.1,
+                     'boxes_flow': None, 'detect_vertical': False}
+
+class PdfminerBackend(PdfBackend):
+    """Extraction with pdfminer.six using PDFMINER_LAPARAMS."""
+    
+    name = 'pdfminer'
+    module = 'pdfminer'
+    requirement = 'pdfminer.six'
+    
+    def page_count(self, pdf_path: str) -> int:
+        from pdfminer.pdfpage import PDFPage
+        
+        with open(pdf_path, 'rb') as file:
+            return sum(1 for _ in PDFPage.get_pages(file))
+    
+    def iter_pages(self, pdf_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LAParams, LTTextContainer
+        
+        page_numbers = range(start, sys.maxsize if end is None else end)
+        for layout in extract_pages(pdf_path, page_numbers=page_numbers, laparams=LAParams(**PDFMINER_LAPARAMS)):
+            yield "".join(element.get_text() for element in layout if isinstance(element, LTTextContainer))
+
+PDF_BACKENDS = {backend.name: backend for backend in (PyPDF2Backend(), PdfiumBackend(), PdfminerBackend())}
+DEFAULT_PDF_BACKEND = 'pypdf2'
+
+def available_pdf_backends() -> List[str]:
+    """Names of the PDF backends whose library is installed."""
+    return [name for name, backend in PDF_BACKENDS.items() if importlib.util.find_spec(backend.module)]
+
+def get_pdf_backend(name: str = DEFAULT_PDF_BACKEND) -> PdfBackend:
+    """Look up a PDF backend by name."""
+    if name not in PDF_BACKENDS:
+        raise ValueError(f"Unknown PDF backend: {name} (choose from {', '.join(PDF_BACKENDS)})")
+    return PDF_BACKENDS[name]
+
+# Pages extracted per task when sharding a PDF across worker processes
+PAGES_PER_TASK = 16
+
+def _extract_page_range(task: Tuple[str, int, int, str]) -> List[str]:
+    """Worker: open the PDF itself and extract text for pages [start, end)."""
+    pdf_path, start, end, backend = task
+    return list(get_pdf_backend(backend).iter_pages(pdf_path, start, end))
+
+def _iter_pages_parallel(pdf_path: str, total: int, workers: int,
+                         backend: str = DEFAULT_PDF_BACKEND) -> Iterator[List[str]]:
+    """Extract page ranges in a process pool and yield them back in page order."""
+    tasks = [(pdf_path, start, min(start + PAGES_PER_TASK, total), backend)
+             for start in range(0, total, PAGES_PER_TASK)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_extract_page_range, tasks)
+
+def iter_pdf_pages(pdf_path: str, progress: Union[bool, ProgressCallback] = True, workers: int = 1,
+                   metrics: Optional[ExtractionMetrics] = None,
+                   backend: str = DEFAULT_PDF_BACKEND) -> Iterator[str]:
+    """Yield the text of each PDF page in order, one page at a time.
+    
+    With workers > 1, pages are sharded across a process pool and
+    reassembled in order. progress=True prints to the console; a callable
+    is called with ('pages', done, total) instead and nothing is printed.
+    """
+    pdf_backend = get_pdf_backend(backend)
+    report = progress if callable(progress) else None
+    if metrics is None:
+        metrics = ExtractionMetrics()
+    try:
+        total = pdf_backend.page_count(pdf_path)
+        if progress is True:
+            print(f"  Total pages: {total}")
+        if workers > 1:
+            batches = _iter_pages_parallel(pdf_path, total, workers, backend)
+        else:
+            batches = ([text] for text in pdf_backend.iter_pages(pdf_path))
+        
+        i = 0
+        last_report = 0.0
+        while True:
+            with metrics.stage('extract_text'):
+                batch = next(batches, None)
+            if batch is None:
+                break
+            metrics.increment('pages', len(batch))
+            for text in batch:
+                i += 1
+                if report is not None:
+                    report('pages', i, total)
+                elif progress and (i == total or time.monotonic() - last_report >= PROGRESS_INTERVAL):
+                    print(f"  Processing page {i}/{total}...", end='\r')
+                    last_report = time.monotonic()
+                yield text
     except Exception as e:
-        print(f"Error reading PDF: {e}")
-    return text
+        _report_read_error(pdf_path, e, progress, metrics)
+
+def _report_read_error(pdf_path: str, error: Exception, progress: Union[bool, ProgressCallback],
+                       metrics: ExtractionMetrics):
+    """Count a PDF that could not be read to the end and report it the way progress is reported."""
+    metrics.increment('read_errors')
+    if callable(progress):
+        logger.error("Error reading PDF %s: %s", pdf_path, error)
+    else:
+        print(f"Error reading PDF: {error}")
+
+def extract_pdf_document(pdf_path: str, progress: Union[bool, ProgressCallback] = True, workers: int = 1,
+                         metrics: Optional[ExtractionMetrics] = None,
+                         backend: str = DEFAULT_PDF_BACKEND, cache_dir: Optional[str] = None) -> PdfText:
+    """Extract text content and page offsets from PDF file.
+    
+    With cache_dir, page text comes from the per-page cache and only new
+    or changed pages are extracted.
+    """
+    if metrics is None:
+        metrics = ExtractionMetrics()
+    read_errors = metrics.counters['read_errors']
+    if cache_dir:
+        try:
+            pages = extract_pages_cached(pdf_path, cache_dir, backend, progress=progress, metrics=metrics,
+                                         workers=workers)[0]
+        except Exception as e:
+            _report_read_error(pdf_path, e, progress, metrics)
+            pages = []
+    else:
+        pages = list(iter_pdf_pages(pdf_path, progress, workers, metrics, backend))
+    
+    # Join once instead of growing a string per page
+    text = "\n".join(pages) + "\n" if pages else ""
+    return PdfText(text, build_page_offsets(pages), metrics.counters['read_errors'] == read_errors)
+
+def extract_text_from_pdf(pdf_path: str, progress: Union[bool, ProgressCallback] = True, workers: int = 1,
+                          metrics: Optional[ExtractionMetrics] = None, backend: str = DEFAULT_PDF_BACKEND,
+                          cache_dir: Optional[str] = None) -> str:
+    """Extract text content from PDF file, reusing cached page text when cache_dir is set."""
+    return extract_pdf_document(pdf_path, progress, workers, metrics, backend, cache_dir).text
+
+# PAN format: 5 letters, 4 digits, 1 letter. Matched case-insensitively on the
+# original text (no uppercase copy of the document); only matches are uppercased.
+# re.ASCII stops IGNORECASE from letting [A-Z] match the Kelvin sign, long s,
+# dotless i and dotted I.
+PAN_PATTERN = re.compile(r'\b[A-Z]{5}[0-9]{4}[A-Z]\b', re.IGNORECASE | re.ASCII)
+
+class PanOccurrence(NamedTuple):
+    """One mention of a PAN number: character span and 1-based page number."""
+    start: int
+    end: int
+    page: int
+
+def build_pan_index(text: str, page_offsets: Optional[List[Tuple[int, int]]] = None) -> Dict[str, List[PanOccurrence]]:
+    """Index every mention of every PAN number in a single pass, in document order."""
+    index = {}
+    for match in PAN_PATTERN.finditer(text):
+        page = page_at_offset(page_offsets, match.start()) if page_offsets else 1
+        index.setdefault(match.group(0).upper(), []).append(PanOccurrence(match.start(), match.end(), page))
+    return index
 
 def extract_pan_numbers(text: str) -> List[str]:
-    """Extract PAN numbers using regex pattern."""
-    # PAN format: 5 letters, 4 digits, 1 letter
-    pan_pattern = r'\b[A-Z]{5}[0-9]{4}[A-Z]\b'
-    pans = re.findall(pan_pattern, text.upper())
-    return list(set(pans))  # Remove duplicates
-
-def find_context_around_pan(text: str, pan: str, window: int = 150) -> str:
-    """Extract context around PAN number for better entity matching."""
-    pattern = re.compile(re.escape(pan), re.IGNORECASE)
-    match = pattern.search(text)
-    
-    if match:
-        start = max(0, match.start() - window)
-        end = min(len(text), match.end() + window)
-        return text[start:end]
-    return ""
-
-def extract_person_names(text: str, nlp) -> List[str]:
-    """Extract person names using spaCy NER."""
-    doc = nlp(text)
-    persons = []
-    
-    for ent in doc.ents:
-        if ent.label_ == "PERSON":
-            # Clean the name
-            name = ent.text.strip()
-            # Filter out single characters and common false positives
-            if len(name) > 2 and not name.isdigit():
-                persons.append(name)
-    
-    return persons
-
-def extract_organizations(text: str, nlp) -> List[str]:
-    """Extract organization names using spaCy NER."""
-    doc = nlp(text)
-    orgs = []
-    
-    for ent in doc.ents:
-        if ent.label_ == "ORG":
-            org = ent.text.strip()
-            if len(org) > 2 and not org.isdigit():
-                orgs.append(org)
-    
-    return orgs
-
-def find_nearest_entity(pan: str, context: str, persons: List[str], orgs: List[str]) -> Tuple[str, str]:
-    """Find the nearest person or organization to the PAN number."""
-    context_lower = context.lower()
-    pan_pos = context_lower.find(pan.lower())
-    
-    if pan_pos == -1:
+    """Extract unique PAN numbers using regex pattern, in order of first mention."""
+    return list(build_pan_index(text))
+
+# Furthest a context slice or parse region is widened to reach a boundary
+SNAP_LIMIT = 80
+
+def snap_to_boundaries(text: str, start: int, end: int, limit: int = SNAP_LIMIT) -> Tuple[int, int]:
+    """Widen [start, end) to the enclosing line breaks, or else whitespace, so no name is cut in half."""
+    start, end = max(0, start), min(len(text), end)
+    if start > 0:
+        newline = text.rfind('\n', max(0, start - limit), start)
+        if newline >= 0:
+            start = newline + 1
+        else:
+            floor = max(0, start - limit)
+            while start > floor and not text[start - 1].isspace():
+                start -= 1
+    if end < len(text):
+        newline = text.find('\n', end, end + limit)
+        if newline >= 0:
+            end = newline
+        else:
+            ceiling = min(len(text), end + limit)
+            while end < ceiling and not text[end].isspace():
+                end += 1
+    return start, end
+
+def context_around_occurrence(text: str, occurrence: Tuple[int, int], window: int = 150) -> str:
+    """Slice the context around one indexed PAN mention, snapped to line or word boundaries."""
+    start, end = snap_to_boundaries(text, occurrence[0] - window, occurrence[1] + window)
+    return text[start:end]
+
+class EntitySpan(NamedTuple):
+    """Named entity found by spaCy, with character offsets into the document."""
+    text: str
+    label: str
+    start: int
+    end: int
+
+# Characters handed to spaCy per call, well below nlp.max_length
+NER_CHUNK_SIZE = 100000
+
+def _split_into_chunks(text: str, chunk_size: int = NER_CHUNK_SIZE) -> List[Tuple[int, str]]:
+    """Split text into (offset, chunk) pieces, cutting at line breaks where possible."""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + chunk_size)
+        if end < len(text):
+            # Avoid cutting a name in half at the chunk boundary
+            newline = text.rfind('\n', start, end)
+            if newline > start:
+                end = newline + 1
+        chunks.append((start, text[start:end]))
+        start = end
+    return chunks
+
+SPACY_MODEL = "en_core_web_sm"
+
+# Pipeline components PERSON/ORG extraction never reads
+UNUSED_COMPONENTS = ["tagger", "morphologizer", "parser", "senter", "attribute_ruler", "lemmatizer"]
+
+# Loaded spaCy models, keyed by model name (one load per process)
+_NLP_CACHE = {}
+
+def load_nlp(model: str = SPACY_MODEL):
+    """Load a spaCy model with only the NER components, cached per process."""
+    if model in _NLP_CACHE:
+        return _NLP_CACHE[model]
+    
+    import spacy
+    
+    try:
+        nlp = spacy.load(model, exclude=UNUSED_COMPONENTS)
+    except OSError as e:
+        logger.error("spaCy model %s is not installed", model)
+        raise OSError(f"spaCy model '{model}' is not installed; run: python -m spacy download {model}") from e
+    
+    # The shared tok2vec only feeds the excluded components unless ner listens to it
+    if "tok2vec" in nlp.pipe_names and not nlp.get_pipe("tok2vec").listening_components:
+        nlp.remove_pipe("tok2vec")
+    
+    _NLP_CACHE[model] = nlp
+    return nlp
+
+# Default nlp.pipe settings for batched NER
+NER_BATCH_SIZE = 64
+NER_N_PROCESS = 1
+
+def merge_regions(regions: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Merge overlapping (start, end) character regions into disjoint ones."""
+    merged = []
+    for start, end in sorted(regions):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def subtract_regions(regions: List[Tuple[int, int]], covered: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Parts of the regions not inside any covered region; both must be merged."""
+    remaining = []
+    i = 0
+    for start, end in regions:
+        while i < len(covered) and covered[i][1] <= start:
+            i += 1
+        j = i
+        while start < end and j < len(covered) and covered[j][0] < end:
+            if covered[j][0] > start:
+                remaining.append((start, covered[j][0]))
+            start = max(start, covered[j][1])
+            j += 1
+        if start < end:
+            remaining.append((start, end))
+    return remaining
+
+def parse_entity_spans(text: str, nlp, regions: Optional[List[Tuple[int, int]]] = None,
+                       batch_size: int = NER_BATCH_SIZE, n_process: int = NER_N_PROCESS,
+                       metrics: Optional[ExtractionMetrics] = None) -> List[EntitySpan]:
+    """Run spaCy NER over the document (or only the given regions) in batches."""
+    if regions is None:
+        regions = [(0, len(text))]
+    
+    pieces = []
+    for start, end in merge_regions(regions):
+        start, end = max(0, start), min(len(text), end)
+        for offset, chunk in _split_into_chunks(text[start:end]):
+            pieces.append((chunk, start + offset))
+    if not pieces:
+        return []
+    if metrics is not None:
+        metrics.increment('spacy_docs_parsed', len(pieces))
+        metrics.increment('spacy_chars_processed', sum(len(chunk) for chunk, _ in pieces))
+    
+    # nlp.pipe batches the pieces and fans them out over n_process workers
+    spans = []
+    docs = nlp.pipe(pieces, as_tuples=True, batch_size=batch_size, n_process=n_process)
+    for doc, offset in docs:
+        for ent in doc.ents:
+            spans.append(EntitySpan(ent.text, ent.label_, offset + ent.start_char, offset + ent.end_char))
+    return spans
+
+# spaCy labels linked to PANs and the entity type each is reported as
+ENTITY_TYPES = {"PERSON": "Person", "ORG": "Organisation"}
+
+def _clean_entity(span: EntitySpan) -> Optional[EntitySpan]:
+    """Strip an entity's text, or drop it if it is a likely false positive."""
+    # Clean the name
+    name = span.text.strip()
+    # Filter out single characters and common false positives
+    if len(name) > 2 and not name.isdigit():
+        return span._replace(text=name)
+    return None
+
+class EntityIndex:
+    """Person and organisation spans sorted by offset for nearest-entity lookups.
+    
+    Entities ending before a PAN are kept sorted by end and entities starting
+    after it by start, so the closest one on either side is a single bisect
+    away even when spans overlap.
+    """
+    
+    def __init__(self, spans: Iterable[EntitySpan]):
+        entities = [_clean_entity(span) for span in spans if span.label in ENTITY_TYPES]
+        entities = [entity for entity in entities if entity]
+        # Among equal ends (or starts) the longest span sorts nearest the PAN
+        self.by_end = sorted(entities, key=lambda e: (e.end, -e.start))
+        self.ends = [entity.end for entity in self.by_end]
+        self.by_start = sorted(entities, key=lambda e: (e.start, -e.end))
+        self.starts = [entity.start for entity in self.by_start]
+    
+    def __len__(self) -> int:
+        return len(self.by_start)
+    
+    def preceding(self, offset: int) -> Optional[EntitySpan]:
+        """Closest entity ending at or before offset."""
+        i = bisect.bisect_right(self.ends, offset)
+        return self.by_end[i - 1] if i else None
+    
+    def following(self, offset: int) -> Optional[EntitySpan]:
+        """Closest entity starting at or after offset."""
+        i = bisect.bisect_left(self.starts, offset)
+        return self.by_start[i] if i < len(self.by_start) else None
+
+def find_nearest_entity(index: EntityIndex, pan_start: int, pan_end: int,
+                        window: int = sys.maxsize, bounds: Optional[Tuple[int, int]] = None) -> Tuple[str, str]:
+    """Find the nearest person or organization within window characters of the PAN.
+    
+    Distance is the gap between the entity and the PAN. The window expands
+    to entity boundaries, so a name it would cut in half still counts;
+    bounds, if given, further require the entity to lie inside that
+    region. On a tie the entity before the PAN wins, since names usually
+    precede their PAN.
+    """
+    before = index.preceding(pan_start)
+    if before and (before.end <= pan_start - window or (bounds and before.start < bounds[0])):
+        before = None
+    after = index.following(pan_end)
+    if after and (after.start >= pan_end + window or (bounds and after.end > bounds[1])):
+        after = None
+    
+    if before and (not after or pan_start - before.end <= after.start - pan_end):
+        closest = before
+    else:
+        closest = after
+    
+    if closest is None:
         return None, None
+    return closest.text, ENTITY_TYPES[closest.label]
+
+# Words of a counterparty name as matched by the dictionary stage
+WORD_PATTERN = re.compile(r'\w+')
+
+class CounterpartyMatcher:
+    """Aho-Corasick automaton over a master list of known person and company names.
+    
+    The automaton runs over words rather than characters: names match
+    case-insensitively on whole words, punctuation between words is ignored
+    ("ABC Pvt. Ltd." matches "abc pvt ltd"), and a list of ~500k names stays
+    at a few million transitions. A document is scanned in one linear pass.
+    """
+    
+    def __init__(self, names: Iterable[Tuple[str, str]]):
+        # Transitions live in one dict keyed by (node, word) to keep memory flat
+        self.goto = {}
+        self.names = []
+        self.labels = []
+        outputs = [-1]
+        depths = [0]
+        children = [[]]
+        
+        for name, label in names:
+            words = [sys.intern(word) for word in WORD_PATTERN.findall(name.lower())]
+            if not words:
+                continue
+            node = 0
+            for word in words:
+                child = self.goto.get((node, word))
+                if child is None:
+                    child = len(outputs)
+                    self.goto[(node, word)] = child
+                    children[node].append((word, child))
+                    outputs.append(-1)
+                    depths.append(depths[node] + 1)
+                    children.append([])
+                node = child
+            if outputs[node] == -1:
+                outputs[node] = len(self.names)
+                self.names.append(name.strip())
+                self.labels.append(label)
+        
+        # Breadth-first pass for failure links and dictionary suffix links
+        self.fail = [0] * len(outputs)
+        self.suffix = [-1] * len(outputs)
+        queue = [child for _, child in children[0]]
+        for node in queue:
+            for word, child in children[node]:
+                state = self.fail[node]
+                while state and (state, word) not in self.goto:
+                    state = self.fail[state]
+                self.fail[child] = self.goto.get((state, word), 0)
+                fallback = self.fail[child]
+                self.suffix[child] = fallback if outputs[fallback] != -1 else self.suffix[fallback]
+                queue.append(child)
+        self.outputs = outputs
+        self.depths = depths
+        self.max_depth = max(depths)
+        self.fingerprint = hashlib.sha256("\n".join(
+            f"{name}|{label}" for name, label in zip(self.names, self.labels)).encode('utf-8')).hexdigest()
+    
+    def __len__(self) -> int:
+        return len(self.names)
+    
+    def find_all(self, text: str) -> List[EntitySpan]:
+        """Find every known name in the text, in one pass over its words."""
+        spans = []
+        # Start offsets of the last words, enough to cover the longest name
+        starts = collections.deque(maxlen=max(1, self.max_depth))
+        node = 0
+        for match in WORD_PATTERN.finditer(text):
+            word = match.group(0).lower()
+            starts.append(match.start())
+            while node and (node, word) not in self.goto:
+                node = self.fail[node]
+            node = self.goto.get((node, word), 0)
+            
+            hit = node if self.outputs[node] != -1 else self.suffix[node]
+            while hit != -1:
+                name_id = self.outputs[hit]
+                start = starts[-self.depths[hit]]
+                spans.append(EntitySpan(self.names[name_id], self.labels[name_id], start, match.end()))
+                hit = self.suffix[hit]
+        return spans
+    
+    def save(self, path: str):
+        """Persist the built automaton for fast loading."""
+        # Write then rename so concurrent readers never see a partial automaton
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as file:
+                pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+    
+    @staticmethod
+    def load(path: str) -> 'CounterpartyMatcher':
+        """Load an automaton persisted with save()."""
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+
+def read_counterparties(names_path: str) -> Iterator[Tuple[str, str]]:
+    """Read a master list with one name per line, optionally followed by a tab and
+    its type (Person or Organisation); untyped names count as organisations."""
+    labels = {"person": "PERSON", "organisation": "ORG", "organization": "ORG", "org": "ORG"}
+    with open(names_path, encoding='utf-8') as file:
+        for line in file:
+            name, _, entity_type = line.rstrip('\n').partition('\t')
+            if name.strip():
+                yield name, labels.get(entity_type.strip().lower(), "ORG")
+
+# Built counterparty automatons, keyed by master list path (one load per process)
+_MATCHER_CACHE = {}
+
+def load_counterparty_matcher(names_path: str) -> CounterpartyMatcher:
+    """Load the automaton for a master list, rebuilding its on-disk copy when stale."""
+    if names_path in _MATCHER_CACHE:
+        return _MATCHER_CACHE[names_path]
+    
+    automaton_path = names_path + '.automaton'
+    matcher = None
+    if os.path.exists(automaton_path) and os.path.getmtime(automaton_path) >= os.path.getmtime(names_path):
+        try:
+            matcher = CounterpartyMatcher.load(automaton_path)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logger.warning("Rebuilding unreadable automaton %s: %s", automaton_path, e)
+    if matcher is None:
+        matcher = CounterpartyMatcher(read_counterparties(names_path))
+        try:
+            matcher.save(automaton_path)
+        except OSError as e:
+            # A read-only list directory only costs a rebuild next time
+            logger.warning("Could not save automaton %s: %s", automaton_path, e)
     
-    # Find closest entity (person or org)
-    closest_entity = None
-    closest_distance = float('inf')
-    entity_type = None
-    
-    # Check persons
-    for person in persons:
-        pos = context_lower.find(person.lower())
-        if pos != -1:
-            distance = abs(pos - pan_pos)
-            if distance < closest_distance:
-                closest_distance = distance
-                closest_entity = person
-                entity_type = "Person"
-    
-    # Check organizations
-    for org in orgs:
-        pos = context_lower.find(org.lower())
-        if pos != -1:
-            distance = abs(pos - pan_pos)
-            if distance < closest_distance:
-                closest_distance = distance
-                closest_entity = org
-                entity_type = "Organisation"
-    
-    return closest_entity, entity_type
-
-def extract_with_patterns(text: str, pan: str) -> Tuple[str, str]:
-    """Use pattern matching to find PAN relationships."""
-    # Common patterns in documents
-    patterns = [
-        # "PAN: XXXXX of Mr./Ms./Mrs. Name"
-        (r'(?:PAN|Pan|pan)[\s:]+' + re.escape(pan) + r'\s+(?:of|for|belonging to|issued to)\s+(?:Mr\.|Ms\.|Mrs\.|Dr\.|Shri|Smt\.)\s*([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)', 'Person'),
-        # "Mr./Ms. Name (PAN: XXXXX)"
-        (r'(?:Mr\.|Ms\.|Mrs\.|Dr\.|Shri|Smt\.)\s*([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\s*(?:\(|,|\s)(?:PAN|Pan|pan)[\s:]*' + re.escape(pan), 'Person'),
-        # "Company Name - PAN: XXXXX"
-        (r'([A-Z][A-Za-z\s&,\.]+?(?:Ltd|Limited|Pvt|Private|Corporation|Corp|Inc|Company|Enterprises|Industries))\s*(?:-|–|:|,)?\s*(?:PAN|Pan|pan)[\s:]*' + re.escape(pan), 'Organisation'),
-        # "PAN XXXXX in the name of Company"
-        (r'(?:PAN|Pan|pan)[\s:]*' + re.escape(pan) + r'\s+(?:in the name of|belongs to|for)\s+([A-Z][A-Za-z\s&,\.]+?(?:Ltd|Limited|Pvt|Private|Corporation|Corp|Inc|Company|Enterprises|Industries))', 'Organisation'),
-    ]
-    
-    for pattern, entity_type in patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            return match.group(1).strip(), entity_type
-    
-    return None, None
-
-def process_entities(text: str) -> List[Dict]:
-    """Main processing function to extract entities and relations."""
-    print("\n[2] Loading spaCy model (lightweight)...")
+    _MATCHER_CACHE[names_path] = matcher
+    return matcher
+
+# Generic PAN group shared by the relation patterns, ASCII-only like PAN_PATTERN
+# while names elsewhere in the patterns may still be Unicode
+PAN_GROUP = r'(?P<pan>(?a:[A-Z]{5}[0-9]{4}[A-Z]))'
+
+# Common patterns in documents, compiled once with a generic PAN group so a
+# single scan per template links every PAN in the text. Order is priority.
+RELATION_PATTERNS = [
+    # "PAN: XXXXX of Mr./Ms./Mrs. Name"
+    (re.compile(r'(?:PAN|Pan|pan)[\s:]+' + PAN_GROUP + r'\s+(?:of|for|belonging to|issued to)\s+(?:Mr\.|Ms\.|Mrs\.|Dr\.|Shri|Smt\.)\s*(?P<entity>[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)', re.IGNORECASE), 'Person'),
+    # "Mr./Ms. Name (PAN: XXXXX)"
+    (re.compile(r'(?:Mr\.|Ms\.|Mrs\.|Dr\.|Shri|Smt\.)\s*(?P<entity>[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\s*(?:\(|,|\s)(?:PAN|Pan|pan)[\s:]*' + PAN_GROUP, re.IGNORECASE), 'Person'),
+    # "Company Name - PAN: XXXXX"
+    (re.compile(r'(?P<entity>[A-Z][A-Za-z\s&,\.]+?(?:Ltd|Limited|Pvt|Private|Corporation|Corp|Inc|Company|Enterprises|Industries))\s*(?:-|–|:|,)?\s*(?:PAN|Pan|pan)[\s:]*' + PAN_GROUP, re.IGNORECASE), 'Organisation'),
+    # "PAN XXXXX in the name of Company"
+    (re.compile(r'(?:PAN|Pan|pan)[\s:]*' + PAN_GROUP + r'\s+(?:in the name of|belongs to|for)\s+(?P<entity>[A-Z][A-Za-z\s&,\.]+?(?:Ltd|Limited|Pvt|Private|Corporation|Corp|Inc|Company|Enterprises|Industries))', re.IGNORECASE), 'Organisation'),
+]
+
+def match_relation_patterns(text: str, regions: Optional[List[Tuple[int, int]]] = None) -> Dict[str, Tuple[str, str]]:
+    """Link every PAN in the text (or only the given regions) to an entity with one scan per pattern."""
+    regions = merge_regions(regions) if regions is not None else [(0, len(text))]
+    relations = {}
+    for pattern, entity_type in RELATION_PATTERNS:
+        for start, end in regions:
+            match = pattern.search(text, start, end)
+            while match:
+                pan = match.group('pan').upper()
+                # Earlier patterns and earlier matches win, as with per-PAN search
+                if pan not in relations:
+                    relations[pan] = (match.group('entity').strip(), entity_type)
+                # Resume at the PAN's last letter, not the match end: a trailing
+                # entity group may have swallowed the next mention's 'PAN'
+                # keyword, and per-PAN search lets that letter start a name
+                match = pattern.search(text, match.end('pan') - 1, end)
+    return relations
+
+class TextFragment(NamedTuple):
+    """Text drawn by one text-showing operator, at its page position."""
+    text: str
+    x: float
+    y: float
+    font_size: float
+    width: float  # Advance of the drawn glyphs, in page units
+    space_width: float  # Width of a space glyph in the fragment's font, in page units
+
+# Layout tolerances in units of the font size: baselines closer than
+# ROW_TOLERANCE share a row, and a horizontal gap wider than CELL_GAP
+# starts a new cell. Glyphs of fonts without a width table are taken to be
+# CHAR_WIDTH wide. Within a cell, a gap wider than SPACE_GAP space glyphs
+# separates words (PyPDF2 uses the same half-space rule for TJ kerning);
+# positioned words sit about one space apart, small-caps runs about zero.
+ROW_TOLERANCE = 0.5
+CELL_GAP = 1.0
+CHAR_WIDTH = 0.5
+SPACE_GAP = 0.5
+
+class FontWidths(NamedTuple):
+    """Glyph widths of a font in thousandths of the font size, keyed by character code."""
+    widths: Dict[int, float]
+    default: float
+    code_bytes: int  # Bytes per character code: 2 for composite (Type0) fonts
+
+def _font_widths(font) -> FontWidths:
+    """Read glyph widths from a font dictionary: /Widths for simple fonts, /W and /DW for Type0."""
+    fallback = FontWidths({}, CHAR_WIDTH * 1000, 1)
+    if font is None:
+        return fallback
     try:
-        nlp = spacy.load("en_core_web_sm")
-    except:
-        print("  spaCy model not found. Downloading...")
-        import os
-        os.system("python -m spacy download en_core_web_sm")
-        nlp = spacy.load("en_core_web_sm")
-    
-    print("\n[3] Extracting PAN numbers...")
-    pan_numbers = extract_pan_numbers(text)
+        font = font.get_object()
+        if font.get('/Subtype') == '/Type0':
+            descendant = font['/DescendantFonts'][0].get_object()
+            entries = descendant.get('/W')
+            entries = list(entries.get_object()) if entries is not None else []
+            widths = {}
+            i = 0
+            while i + 1 < len(entries):
+                first, item = int(entries[i]), entries[i + 1].get_object()
+                if isinstance(item, list):
+                    # c [w1 w2 ...]: consecutive codes from c
+                    widths.update((first + k, float(width)) for k, width in enumerate(item))
+                    i += 2
+                else:
+                    # c_first c_last w: one width for the whole range
+                    widths.update((code, float(entries[i + 2])) for code in range(first, int(item) + 1))
+                    i += 3
+            return FontWidths(widths, float(descendant.get('/DW', 1000)), 2)
+        
+        table = font.get('/Widths')
+        if table is None:
+            # The standard 14 fonts may omit widths
+            return fallback
+        first = int(font.get('/FirstChar', 0))
+        descriptor = font.get('/FontDescriptor')
+        missing = descriptor.get_object().get('/MissingWidth') if descriptor is not None else None
+        widths = {first + k: float(width) for k, width in enumerate(table.get_object())}
+        return FontWidths(widths, float(missing) if missing is not None else fallback.default, 1)
+    except Exception:
+        return fallback
+
+def _pdf_string_bytes(value) -> bytes:
+    """The raw character codes of a text operand."""
+    original = getattr(value, 'original_bytes', None)
+    if original is not None:
+        return bytes(original)
+    return value.encode('latin-1', 'replace')
+
+def _decode_pdf_string(value, char_map) -> str:
+    """Decode a text operand the way PyPDF2 does, given a build_char_map() result."""
+    if isinstance(value, str):
+        return value
+    if char_map is None:
+        return bytes(value).decode('latin-1')
+    encoding, mapping = char_map[2], char_map[3]
+    if isinstance(encoding, str):
+        try:
+            text = bytes(value).decode(encoding, 'surrogatepass')
+        except Exception:
+            text = bytes(value).decode('utf-16-be' if encoding == 'charmap' else 'charmap', 'surrogatepass')
+    else:
+        text = "".join(encoding.get(byte, chr(byte)) for byte in bytes(value))
+    return "".join(mapping.get(char, char) for char in text)
+
+def extract_page_layout(page) -> Tuple[str, List[TextFragment]]:
+    """Extract a page's text and, in the same pass, each text fragment with its position.
+    
+    PyPDF2 reports text to visitors a whole line at a time, so fragments are
+    taken from the text operators themselves, positioned by the text and
+    graphics matrices PyPDF2 tracks. PyPDF2 does not advance the text
+    matrix past drawn glyphs, so each fragment's advance is summed here from
+    the font's glyph widths and carried to the next operator on the line.
+    """
+    try:
+        from PyPDF2._cmap import build_char_map
+    except ImportError:
+        build_char_map = None
+    
+    fragments = []
+    fonts = {}
+    state = {'char_map': None, 'widths': _font_widths(None), 'size': 12.0, 'leading': 0.0,
+             'char_spacing': 0.0, 'word_spacing': 0.0, 'scaling': 1.0, 'advance': 0.0}
+    
+    def advance(operand) -> float:
+        """Horizontal advance of a string operand in unscaled text space units."""
+        font = state['widths']
+        codes = _pdf_string_bytes(operand)
+        if font.code_bytes == 2:
+            codes = [codes[k] << 8 | codes[k + 1] for k in range(0, len(codes) - 1, 2)]
+        total = 0.0
+        for code in codes:
+            total += font.widths.get(code, font.default) / 1000 * state['size'] + state['char_spacing']
+            # Word spacing applies to the single-byte space code only
+            if code == 32 and font.code_bytes == 1:
+                total += state['word_spacing']
+        return total
+    
+    def visit(operator, operands, cm, tm):
+        if operator == b'Tf':
+            name = operands[0]
+            if name not in fonts:
+                char_map, font = None, None
+                if build_char_map is not None:
+                    try:
+                        char_map = build_char_map(name, 200.0, page)
+                        font = char_map[4]
+                    except Exception:
+                        char_map = None
+                if font is None:
+                    try:
+                        font = page['/Resources']['/Font'][name]
+                    except Exception:
+                        font = None
+                fonts[name] = (char_map, _font_widths(font))
+            state['char_map'], state['widths'] = fonts[name]
+            state['size'] = float(operands[1])
+        elif operator == b'Tc':
+            state['char_spacing'] = float(operands[0])
+        elif operator == b'Tw':
+            state['word_spacing'] = float(operands[0])
+        elif operator == b'Tz':
+            state['scaling'] = float(operands[0]) / 100
+        elif operator == b'TL':
+            state['leading'] = float(operands[0])
+        elif operator in (b'TD', b'Td', b'Tm', b'T*', b'BT'):
+            if operator == b'TD':
+                state['leading'] = -float(operands[1])
+            # The text matrix moves to a new position; drawn glyphs no longer offset it
+            state['advance'] = 0.0
+        elif operator in (b'Tj', b"'", b'"', b'TJ'):
+            char_map = state['char_map']
+            if operator == b'TJ':
+                # Large negative kerning between strings stands for a space
+                space = char_map[1] if char_map is not None else 250.0
+                parts = [_decode_pdf_string(op, char_map) if isinstance(op, (str, bytes))
+                         else (" " if float(op) <= -space else "") for op in operands[0]]
+                text = "".join(parts)
+                # Numbers shift the next glyph left by thousandths of the font size
+                width = sum(advance(op) if isinstance(op, (str, bytes)) else -float(op) / 1000 * state['size']
+                            for op in operands[0])
+            else:
+                text = _decode_pdf_string(operands[-1], char_map)
+                width = advance(operands[-1])
+                if operator in (b"'", b'"'):
+                    state['advance'] = 0.0
+            # Text space to page space; ' and " move to the next line first
+            line_drop = state['leading'] if operator in (b"'", b'"') else 0.0
+            x_scale = tm[0] * cm[0] + tm[1] * cm[2]
+            text_x = tm[4] + state['advance'] * tm[0]
+            text_y = tm[5] - line_drop + state['advance'] * tm[1]
+            x = text_x * cm[0] + text_y * cm[2] + cm[4]
+            y = text_x * cm[1] + text_y * cm[3] + cm[5]
+            scale = abs(tm[3] * cm[3]) or 1.0
+            width *= state['scaling']
+            state['advance'] += width
+            if text.strip():
+                font = state['widths']
+                space_width = font.widths.get(32, font.default) / 1000 * state['size'] * state['scaling']
+                fragments.append(TextFragment(text, x, y, state['size'] * scale, abs(width * x_scale),
+                                              abs(space_width * x_scale)))
+    
+    text = page.extract_text(visitor_operand_before=visit)
+    return text, fragments
+
+def group_table_rows(fragments: List[TextFragment]) -> List[List[str]]:
+    """Reconstruct rows of cells, top to bottom and left to right, from positioned fragments.
+    
+    Fragments within a cell are joined with a space only when the drawn text
+    has none and the gap between them is wider than SPACE_GAP space glyphs,
+    so small-caps runs (a large initial followed by smaller letters) stay
+    one word.
+    """
+    rows = []
+    for fragment in sorted(fragments, key=lambda f: -f.y):
+        if rows and abs(rows[-1][0].y - fragment.y) <= ROW_TOLERANCE * fragment.font_size:
+            rows[-1].append(fragment)
+        else:
+            rows.append([fragment])
+    
+    table = []
+    for row in rows:
+        cells = []
+        cell_end = None
+        for fragment in sorted(row, key=lambda f: f.x):
+            gap = fragment.x - cell_end if cell_end is not None else None
+            if gap is not None and gap <= CELL_GAP * fragment.font_size:
+                spaced = cells[-1][-1:].isspace() or fragment.text[:1].isspace()
+                cells[-1] += (" " if not spaced and gap > SPACE_GAP * fragment.space_width else "") + fragment.text
+            else:
+                cells.append(fragment.text)
+            cell_end = max(cell_end if cell_end is not None else fragment.x, fragment.x + fragment.width)
+        table.append([" ".join(cell.split()) for cell in cells])
+    return table
+
+# Company suffixes marking a name cell as an organisation
+ORGANISATION_SUFFIX = re.compile(r'\b(?:Ltd|Limited|Pvt|Private|Corporation|Corp|Inc|Company|Enterprises|Industries|LLP)\b',
+                                 re.IGNORECASE)
+
+def _table_pan(cell: str) -> Optional[str]:
+    """The PAN a cell holds, if the cell is just a PAN."""
+    match = PAN_PATTERN.fullmatch(cell.strip(' :;,.()'))
+    return match.group(0).upper() if match else None
+
+def _is_name_cell(cell: str) -> bool:
+    letters = sum(char.isalpha() for char in cell)
+    digits = sum(char.isdigit() for char in cell)
+    return letters >= 3 and digits * 2 < letters and _table_pan(cell) is None
+
+def link_table_rows(rows: List[List[str]]) -> Dict[str, Tuple[str, str]]:
+    """Link the PAN cell of each table row to the first name cell in that row.
+    
+    Only a row's first PAN belongs to its name; further PAN cells (related
+    or counterparty PANs) are left to the rows where they come first.
+    """
+    links = {}
+    for cells in rows:
+        pans = [pan for pan in map(_table_pan, cells) if pan]
+        names = [cell for cell in cells if _is_name_cell(cell)]
+        # A row needs a PAN cell and a separate name cell; prose lines have neither
+        if not pans or not names:
+            continue
+        name = " ".join(names[0].split())
+        entity_type = 'Organisation' if ORGANISATION_SUFFIX.search(name) else 'Person'
+        links.setdefault(pans[0], (name, entity_type))
+    return links
+
+def extract_pdf_layout(pdf_path: str, progress: Union[bool, ProgressCallback] = True,
+                       metrics: Optional[ExtractionMetrics] = None,
+                       cache_dir: Optional[str] = None) -> Tuple[PdfText, Dict[str, Tuple[str, str]]]:
+    """Extract text and page offsets plus PAN links read from table rows, in one pass over the PDF.
+    
+    With cache_dir, only pages missing from the per-page cache are laid out.
+    """
+    import PyPDF2
+    
+    if metrics is None:
+        metrics = ExtractionMetrics()
+    report = progress if callable(progress) else None
+    pages = []
+    links = {}
+    complete = True
+    try:
+        if cache_dir:
+            pages, _, page_links = extract_pages_cached(pdf_path, cache_dir, layout=True, progress=progress,
+                                                        metrics=metrics)
+            for page_link in page_links:
+                for pan, link in page_link.items():
+                    links.setdefault(pan, link)
+            return PdfText("\n".join(pages) + "\n" if pages else "", build_page_offsets(pages)), links
+        with open(pdf_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            total = len(pdf_reader.pages)
+            for i, page in enumerate(pdf_reader.pages, 1):
+                with metrics.stage('extract_layout'):
+                    text, fragments = extract_page_layout(page)
+                    for pan, link in link_table_rows(group_table_rows(fragments)).items():
+                        links.setdefault(pan, link)
+                pages.append(text)
+                metrics.increment('pages')
+                if report is not None:
+                    report('pages', i, total)
+                elif progress:
+                    print(f"  Processing page {i}/{total}...", end='\r')
+    except Exception as e:
+        complete = False
+        _report_read_error(pdf_path, e, progress, metrics)
+    
+    text = "\n".join(pages) + "\n" if pages else ""
+    return PdfText(text, build_page_offsets(pages), complete), links
+
+class LineIndex:
+    """Start offset of every line in a text, for finding the lines around an offset."""
+    
+    def __init__(self, text: str):
+        self.length = len(text)
+        self.starts = [0]
+        newline = text.find('\n')
+        while newline >= 0:
+            self.starts.append(newline + 1)
+            newline = text.find('\n', newline + 1)
+    
+    def line_of(self, offset: int) -> int:
+        return bisect.bisect_right(self.starts, offset) - 1
+    
+    def span(self, start: int, end: int, radius: int = 0) -> Tuple[int, int]:
+        """Offsets of the lines holding [start, end), plus radius lines either side, without the final newline."""
+        first = max(0, self.line_of(start) - radius)
+        last = self.line_of(max(start, end - 1)) + radius + 1
+        return self.starts[first], self.starts[last] - 1 if last < len(self.starts) else self.length
+
+# Context windows (characters either side of a PAN) tried in order by NER
+CONTEXT_WINDOWS = (200, 400)
+
+# Lines searched before the context windows: the PAN's own line, then one
+# neighbouring line either way
+LINE_RADII = (0, 1)
+
+# Furthest a relation pattern match reaches from the PAN it links
+PATTERN_REACH = 1000
+
+def context_windows_for(window: int) -> Tuple[int, int]:
+    """Context windows for a base window size: the window, then twice it."""
+    return (window, 2 * window)
+
+# Mentions of one PAN examined per window, bounding the work for PANs
+# repeated throughout a document
+MAX_MENTIONS_PER_PAN = 25
+
+def search_steps(context_windows: Tuple[int, ...] = CONTEXT_WINDOWS) -> List[Tuple[str, int]]:
+    """Proximity search steps in order: ('lines', radius) first, then ('chars', window)."""
+    return [('lines', radius) for radius in LINE_RADII] + [('chars', window) for window in context_windows]
+
+def _step_region(text: str, lines: LineIndex, step: Tuple[str, int], start: int, end: int,
+                 reach: int) -> Tuple[int, int]:
+    """Region one search step covers around a PAN mention, snapped to line or word boundaries."""
+    kind, size = step
+    if kind == 'lines':
+        line_start, line_end = lines.span(start, end, size)
+        # Clip very long lines (text without line breaks) to the widest window
+        return snap_to_boundaries(text, max(line_start, start - reach), min(line_end, end + reach))
+    return snap_to_boundaries(text, start - size, end + size)
+
+def pattern_regions(text: str, occurrences: Dict[str, List[Tuple[int, int]]],
+                    lines: Optional[LineIndex] = None) -> List[Tuple[int, int]]:
+    """The lines around each PAN mention, which is all the relation patterns need to scan."""
+    if lines is None:
+        lines = LineIndex(text)
+    return [_step_region(text, lines, ('lines', 1), start, end, PATTERN_REACH)
+            for pan in occurrences for start, end, *_ in occurrences[pan]]
+
+def _link_nearest(index: EntityIndex, pans: List[str], occurrences: Dict[str, List[Tuple[int, int]]],
+                  links: Dict[str, Tuple[str, str]], metrics: ExtractionMetrics, source: str,
+                  text: str, lines: LineIndex, steps: List[Tuple[str, int]], broader: bool = False):
+    """Link each PAN to the nearest indexed entity around any of its mentions."""
+    reach = max([size for kind, size in steps if kind == 'chars'] or [max(CONTEXT_WINDOWS)])
+    for pan in pans:
+        # Try the PAN's own line around each mention first, then wider scopes
+        for number, step in enumerate(steps):
+            for pan_start, pan_end, *_ in occurrences[pan][:MAX_MENTIONS_PER_PAN]:
+                if step[0] == 'lines':
+                    region = _step_region(text, lines, step, pan_start, pan_end, reach)
+                    entity_name, entity_type = find_nearest_entity(index, pan_start, pan_end, bounds=region)
+                else:
+                    entity_name, entity_type = find_nearest_entity(index, pan_start, pan_end, step[1])
+                if entity_name:
+                    links[pan] = (entity_name, entity_type)
+                    break
+            if pan in links:
+                metrics.increment(f"{source}_broader_window_hits" if broader or number else f"{source}_hits")
+                break
+
+def _link_with_ner(text: str, pans: List[str], occurrences: Dict[str, List[Tuple[int, int]]],
+                   links: Dict[str, Tuple[str, str]], nlp, batch_size: int = NER_BATCH_SIZE,
+                   n_process: int = NER_N_PROCESS, metrics: Optional[ExtractionMetrics] = None,
+                   context_windows: Tuple[int, ...] = CONTEXT_WINDOWS, lines: Optional[LineIndex] = None):
+    """Link PANs to spaCy entities, widening the context only for PANs still unresolved.
+    
+    The search starts on each PAN's own line, then its neighbouring lines,
+    then the context windows. Each step parses just the text it adds around
+    the remaining PANs' mentions (at most MAX_MENTIONS_PER_PAN each), so the
+    common case touches a single line and the long tail stays bounded.
+    
+    With n_process > 1 every nlp.pipe call starts a worker pool, so the
+    regions of all steps are parsed up front in a single call instead.
+    """
+    if metrics is None:
+        metrics = ExtractionMetrics()
+    if lines is None:
+        lines = LineIndex(text)
+    reach = max(context_windows)
+    parsed = []
+    spans = []
+    steps = search_steps(context_windows)
+    for number, step in enumerate(steps):
+        if number:
+            metrics.increment('ner_escalations', len(pans))
+        scope = steps[number:] if n_process > 1 else [step]
+        regions = merge_regions([_step_region(text, lines, scope_step, start, end, reach) for scope_step in scope
+                                 for pan in pans for start, end, *_ in occurrences[pan][:MAX_MENTIONS_PER_PAN]])
+        spans.extend(parse_entity_spans(text, nlp, subtract_regions(regions, parsed), batch_size=batch_size,
+                                        n_process=n_process, metrics=metrics))
+        parsed = merge_regions(parsed + regions)
+        
+        _link_nearest(EntityIndex(spans), pans, occurrences, links, metrics, 'ner', text, lines, [step],
+                      broader=number > 0)
+        pans = [pan for pan in pans if pan not in links]
+        if not pans:
+            break
+
+def link_pans(text: str, occurrences: Dict[str, List[Tuple[int, int]]], nlp,
+              batch_size: int = NER_BATCH_SIZE, n_process: int = NER_N_PROCESS,
+              matcher: Optional[CounterpartyMatcher] = None,
+              metrics: Optional[ExtractionMetrics] = None,
+              context_windows: Tuple[int, ...] = CONTEXT_WINDOWS, ner: bool = True,
+              known_links: Optional[Dict[str, Tuple[str, str]]] = None) -> Dict[str, Tuple[str, str]]:
+    """Link PANs to entities by pattern, then known counterparties, then NER (unless ner=False).
+    
+    PANs in known_links (such as those read from table rows) keep those
+    links. With nlp=None the spaCy model is loaded only if PANs remain
+    unresolved after the patterns and the dictionary.
+    """
+    if metrics is None:
+        metrics = ExtractionMetrics()
+    
+    links = {pan: known_links[pan] for pan in occurrences if pan in known_links} if known_links else {}
+    metrics.increment('table_hits', len(links))
+    # Built once per text; every stage searches outward from the PAN's own line
+    lines = LineIndex(text)
+    with metrics.stage('pattern_linking'):
+        relations = match_relation_patterns(text, pattern_regions(text, occurrences, lines))
+        matched = {pan: relations[pan] for pan in occurrences if pan in relations and pan not in links}
+    metrics.increment('pattern_hits', len(matched))
+    links.update(matched)
+    
+    unresolved = [pan for pan in occurrences if pan not in links]
+    if unresolved and matcher is not None:
+        with metrics.stage('dictionary_matching'):
+            index = EntityIndex(matcher.find_all(text))
+            _link_nearest(index, unresolved, occurrences, links, metrics, 'dictionary', text, lines,
+                          search_steps(context_windows))
+        unresolved = [pan for pan in unresolved if pan not in links]
+    if not unresolved or not ner:
+        return links
+    
+    if nlp is None:
+        with metrics.stage('load_model'):
+            nlp = load_nlp()
+    with metrics.stage('ner'):
+        _link_with_ner(text, unresolved, occurrences, links, nlp, batch_size=batch_size, n_process=n_process,
+                       metrics=metrics, context_windows=context_windows, lines=lines)
+    
+    return links
+
+def make_relation(pan: str, entity_name: Optional[str], entity_type: Optional[str]) -> Dict:
+    """Build the PAN_Of relation record for a PAN and its related entity."""
+    if entity_name:
+        return {
+            'entity_type': 'PAN',
+            'value': pan,
+            'relation': 'PAN_Of',
+            'related_entity_type': entity_type,
+            'related_entity': entity_name
+        }
+    # Store unmatched PANs
+    return {
+        'entity_type': 'PAN',
+        'value': pan,
+        'relation': 'PAN_Of',
+        'related_entity_type': 'Unknown',
+        'related_entity': 'Not Found'
+    }
+
+def process_entities(text: str, nlp=None, batch_size: int = NER_BATCH_SIZE, n_process: int = NER_N_PROCESS,
+                     matcher: Optional[CounterpartyMatcher] = None,
+                     metrics: Optional[ExtractionMetrics] = None,
+                     context_windows: Tuple[int, ...] = CONTEXT_WINDOWS, ner: bool = True,
+                     known_links: Optional[Dict[str, Tuple[str, str]]] = None,
+                     page_offsets: Optional[List[Tuple[int, int]]] = None) -> List[Dict]:
+    """Main processing function to extract entities and relations.
+    
+    spaCy is loaded only if some PANs are left unresolved by the relation
+    patterns and known counterparties, and never with ner=False.
+    """
+    if metrics is None:
+        metrics = ExtractionMetrics()
+    
+    print("\n[2] Extracting PAN numbers...")
+    with metrics.stage('pan_detection'):
+        occurrences = build_pan_index(text, page_offsets)
+    pan_numbers = list(occurrences)
+    metrics.increment('pans_found', len(pan_numbers))
     print(f"  Found {len(pan_numbers)} PAN numbers")
     
     if not pan_numbers:
         print("  No PAN numbers found in the document!")
         return []
     
-    print("\n[4] Extracting entities and building relations...")
+    print("\n[3] Extracting entities and building relations...")
+    links = link_pans(text, occurrences, nlp, batch_size=batch_size, n_process=n_process, matcher=matcher,
+                      metrics=metrics, context_windows=context_windows, ner=ner, known_links=known_links)
+    metrics.increment('unmatched', len(pan_numbers) - len(links))
+    if not ner:
+        print(f"  Pattern-only mode: {len(pan_numbers) - len(links)} PANs left unresolved")
     entities = []
     
     for idx, pan in enumerate(pan_numbers, 1):
         print(f"  Processing PAN {idx}/{len(pan_numbers)}: {pan}")
         
-        # Get context around PAN
-        context = find_context_around_pan(text, pan, window=200)
-        
-        # Try pattern matching first (most accurate)
-        entity_name, entity_type = extract_with_patterns(text, pan)
-        
-        # If pattern matching fails, use NER
-        if not entity_name:
-            persons = extract_person_names(context, nlp)
-            orgs = extract_organizations(context, nlp)
-            entity_name, entity_type = find_nearest_entity(pan, context, persons, orgs)
-        
-        # If still no match, try broader context
-        if not entity_name:
-            broader_context = find_context_around_pan(text, pan, window=400)
-            persons = extract_person_names(broader_context, nlp)
-            orgs = extract_organizations(broader_context, nlp)
-            entity_name, entity_type = find_nearest_entity(pan, broader_context, persons, orgs)
-        
-        # Store the result
+        entity_name, entity_type = links.get(pan, (None, None))
+        entities.append(make_relation(pan, entity_name, entity_type))
         if entity_name:
-            entities.append({
-                'entity_type': 'PAN',
-                'value': pan,
-                'relation': 'PAN_Of',
-                'related_entity_type': entity_type,
-                'related_entity': entity_name
-            })
             print(f"    → Linked to: {entity_name} ({entity_type})")
         else:
-            # Store unmatched PANs
-            entities.append({
-                'entity_type': 'PAN',
-                'value': pan,
-                'relation': 'PAN_Of',
-                'related_entity_type': 'Unknown',
-                'related_entity': 'Not Found'
-            })
             print(f"    → Could not find related entity")
     
     return entities
 
-def save_to_csv(entities: List[Dict], output_path: str):
-    """Save extracted entities and relations to CSV file."""
+# Characters carried over between pages so PANs, relation patterns and
+# context windows that span a page break are still seen whole
+STREAM_OVERLAP = 1000
+
+def stream_overlap(context_windows: Tuple[int, ...] = CONTEXT_WINDOWS) -> int:
+    """Overlap between stream buffers, widened for context windows larger than the default."""
+    return max(STREAM_OVERLAP, 2 * max(context_windows))
+
+class TextWindow(NamedTuple):
+    """One stream buffer: PANs starting in text[start:end] belong to it.
+    
+    page_offsets are the spans of the pages in text (the first may start
+    before 0 once its head is dropped); the first of them is first_page.
+    """
+    text: str
+    start: int
+    end: int
+    page_offsets: List[Tuple[int, int]]
+    first_page: int
+
+def iter_text_windows(pages: Iterable[str], overlap: int = STREAM_OVERLAP) -> Iterator[TextWindow]:
+    """Yield bounded buffers over a page stream.
+    
+    At least `overlap` characters of the neighbouring pages surround each
+    buffer's owned range for context.
+    """
+    buffer = ""
+    start = 0
+    page_offsets = []
+    first_page = 1
+    for page in pages:
+        page_offsets.append((len(buffer), len(buffer) + len(page)))
+        buffer += page + "\n"
+        end = len(buffer) - overlap
+        if end > start:
+            yield TextWindow(buffer, start, end, list(page_offsets), first_page)
+            # Drop everything but the look-behind needed by the next range
+            cut = max(0, end - overlap)
+            buffer = buffer[cut:]
+            start = end - cut
+            page_offsets = [(page_start - cut, page_end - cut) for page_start, page_end in page_offsets]
+            while len(page_offsets) > 1 and page_offsets[0][1] < 0:
+                page_offsets.pop(0)
+                first_page += 1
+    if len(buffer) > start:
+        yield TextWindow(buffer, start, len(buffer), page_offsets, first_page)
+
+def find_pan_positions(text: str, start: int = 0, end: int = sys.maxsize, skip: Iterable[str] = (),
+                       page_offsets: Optional[List[Tuple[int, int]]] = None,
+                       first_page: int = 1) -> Dict[str, List[PanOccurrence]]:
+    """Map each PAN starting in text[start:end] to all its mentions there.
+    
+    Page numbers count from first_page, the page of page_offsets[0] (or of
+    the whole text without page_offsets).
+    """
+    positions = {}
+    for match in PAN_PATTERN.finditer(text, start):
+        if match.start() >= end:
+            break
+        pan = match.group(0).upper()
+        if pan not in skip:
+            page = first_page - 1 + (page_at_offset(page_offsets, match.start()) if page_offsets else 1)
+            positions.setdefault(pan, []).append(PanOccurrence(match.start(), match.end(), page))
+    return positions
+
+def iter_linked_entities(windows: Iterable[TextWindow], nlp=None,
+                         batch_size: int = NER_BATCH_SIZE, n_process: int = NER_N_PROCESS,
+                         matcher: Optional[CounterpartyMatcher] = None,
+                         metrics: Optional[ExtractionMetrics] = None,
+                         context_windows: Tuple[int, ...] = CONTEXT_WINDOWS, ner: bool = True,
+                         known_links: Optional[Dict[str, Tuple[str, str]]] = None) -> Iterator[Dict]:
+    """Link PANs buffer by buffer and yield each relation as soon as it is known.
+    
+    A PAN is linked at the first mention where a pattern or nearby entity
+    resolves it; PANs never resolved are yielded as unmatched at the end.
+    """
+    if metrics is None:
+        metrics = ExtractionMetrics()
+    
+    done = set()
+    pending = {}
+    for window in windows:
+        text = window.text
+        # Mentions of PANs owned by this buffer that are not linked yet
+        with metrics.stage('pan_detection'):
+            positions = find_pan_positions(text, window.start, window.end, done, window.page_offsets,
+                                           window.first_page)
+        if not positions:
+            continue
+        metrics.increment('pans_found', sum(1 for pan in positions if pan not in pending))
+        
+        links = link_pans(text, positions, nlp, batch_size=batch_size, n_process=n_process, matcher=matcher,
+                          metrics=metrics, context_windows=context_windows, ner=ner, known_links=known_links)
+        for pan in positions:
+            entity_name, entity_type = links.get(pan, (None, None))
+            if entity_name:
+                done.add(pan)
+                pending.pop(pan, None)
+                yield make_relation(pan, entity_name, entity_type)
+            else:
+                pending[pan] = None
+    
+    metrics.increment('unmatched', len(pending))
+    for pan in pending:
+        yield make_relation(pan, None, None)
+
+def link_document_text(text: str, nlp=None, batch_size: int = NER_BATCH_SIZE, n_process: int = NER_N_PROCESS,
+                       matcher: Optional[CounterpartyMatcher] = None,
+                       metrics: Optional[ExtractionMetrics] = None,
+                       context_windows: Tuple[int, ...] = CONTEXT_WINDOWS, ner: bool = True,
+                       known_links: Optional[Dict[str, Tuple[str, str]]] = None,
+                       page_offsets: Optional[List[Tuple[int, int]]] = None) -> List[Dict]:
+    """Link every PAN in a text held in memory in one pass, as process_entities does, without console output."""
+    if metrics is None:
+        metrics = ExtractionMetrics()
+    with metrics.stage('pan_detection'):
+        occurrences = build_pan_index(text, page_offsets)
+    metrics.increment('pans_found', len(occurrences))
+    if not occurrences:
+        return []
+    
+    links = link_pans(text, occurrences, nlp, batch_size=batch_size, n_process=n_process, matcher=matcher,
+                      metrics=metrics, context_windows=context_windows, ner=ner, known_links=known_links)
+    metrics.increment('unmatched', len(occurrences) - len(links))
+    return [make_relation(pan, *links.get(pan, (None, None))) for pan in occurrences]
+
+def stream_entities(pdf_path: str, nlp=None, progress: Union[bool, ProgressCallback] = True, workers: int = 1,
+                    batch_size: int = NER_BATCH_SIZE, n_process: int = NER_N_PROCESS,
+                    matcher: Optional[CounterpartyMatcher] = None,
+                    metrics: Optional[ExtractionMetrics] = None,
+                    context_windows: Tuple[int, ...] = CONTEXT_WINDOWS, ner: bool = True,
+                    backend: str = DEFAULT_PDF_BACKEND) -> Iterator[Dict]:
+    """Stream PAN relations from a PDF page by page with bounded memory."""
+    pages = iter_pdf_pages(pdf_path, progress, workers, metrics, backend)
+    windows = iter_text_windows(pages, stream_overlap(context_windows))
+    return iter_linked_entities(windows, nlp, batch_size=batch_size, n_process=n_process, matcher=matcher,
+                                metrics=metrics, context_windows=context_windows, ner=ner)
+
+def save_to_csv(entities: Iterable[Dict], output_path: str, include_source: bool = False,
+                metrics: Optional[ExtractionMetrics] = None) -> int:
+    """Save extracted entities and relations to CSV file, row by row."""
+    if metrics is None:
+        metrics = ExtractionMetrics()
+    count = 0
     with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
         fieldnames = ['Entity_Type', 'Entity_Value', 'Relation', 'Related_Entity_Type', 'Related_Entity']
+        if include_source:
+            fieldnames.append('Source_File')
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
         
         writer.writeheader()
         for entity in entities:
-            writer.writerow({
+            row = {
                 'Entity_Type': entity.get('entity_type', ''),
                 'Entity_Value': entity.get('value', ''),
                 'Relation': entity.get('relation', ''),
                 'Related_Entity_Type': entity.get('related_entity_type', ''),
                 'Related_Entity': entity.get('related_entity', '')
-            })
+            }
+            if include_source:
+                row['Source_File'] = entity.get('source_file', '')
+            # Time only the writes; the rows may come from a lazy pipeline
+            with metrics.stage('save_to_csv'):
+                writer.writerow(row)
+            count += 1
+    metrics.increment('rows_written', count)
+    return count
+
+OUTPUT_FORMATS = ('csv', 'json', 'jsonl')
+
+def save_to_json(entities: Iterable[Dict], output_path: str, include_source: bool = False,
+                 metrics: Optional[ExtractionMetrics] = None, lines: bool = False) -> int:
+    """Save relations as a JSON array, or one JSON object per line, record by record."""
+    if metrics is None:
+        metrics = ExtractionMetrics()
+    count = 0
+    with open(output_path, 'w', encoding='utf-8') as file:
+        if not lines:
+            file.write('[')
+        for entity in entities:
+            record = {key: value for key, value in entity.items() if include_source or key != 'source_file'}
+            with metrics.stage('save_to_json'):
+                if lines:
+                    file.write(json.dumps(record, ensure_ascii=False) + '\n')
+                else:
+                    file.write((',\n' if count else '\n') + json.dumps(record, ensure_ascii=False))
+            count += 1
+        if not lines:
+            file.write('\n]\n')
+    metrics.increment('rows_written', count)
+    return count
+
+def save_entities(entities: Iterable[Dict], output_path: str, output_format: str = 'csv',
+                  include_source: bool = False, metrics: Optional[ExtractionMetrics] = None) -> int:
+    """Save relations in one of OUTPUT_FORMATS."""
+    if output_format == 'csv':
+        return save_to_csv(entities, output_path, include_source, metrics)
+    if output_format in ('json', 'jsonl'):
+        return save_to_json(entities, output_path, include_source, metrics, lines=output_format == 'jsonl')
+    raise ValueError(f"Unknown output format: {output_format}")
+
+# Default on-disk cache for extraction results
+CACHE_DIR = ".pan_cache"
+
+# Bump whenever extraction or linking output changes to invalidate cached results
+EXTRACTOR_VERSION = "9"
+
+def _extraction_fingerprint(matcher: Optional[CounterpartyMatcher] = None,
+                           context_windows: Tuple[int, ...] = CONTEXT_WINDOWS, ner: bool = True,
+                           layout: bool = False, backend: str = DEFAULT_PDF_BACKEND) -> str:
+    """Hash of everything besides the PDF bytes that shapes the extracted entities."""
+    parts = [EXTRACTOR_VERSION, SPACY_MODEL if ner else 'no-ner', PAN_PATTERN.pattern, repr(tuple(context_windows))]
+    if layout:
+        parts.append(f"layout|{ROW_TOLERANCE}|{CELL_GAP}|{CHAR_WIDTH}|{SPACE_GAP}")
+    elif backend != DEFAULT_PDF_BACKEND:
+        # Backends lay out the same page differently; layout mode always reads with PyPDF2
+        parts.append(f"backend|{backend}")
+    if matcher is not None:
+        parts.append(matcher.fingerprint)
+    parts.extend(f"{pattern.pattern}|{entity_type}" for pattern, entity_type in RELATION_PATTERNS)
+    return hashlib.sha256("\n".join(parts).encode('utf-8')).hexdigest()
+
+def result_cache_key(pdf_path: str, matcher: Optional[CounterpartyMatcher] = None,
+                     context_windows: Tuple[int, ...] = CONTEXT_WINDOWS, ner: bool = True,
+                     layout: bool = False, backend: str = DEFAULT_PDF_BACKEND) -> str:
+    """Cache key from the PDF content hash, extractor version and pattern set."""
+    digest = hashlib.sha256()
+    with open(pdf_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    digest.update(_extraction_fingerprint(matcher, context_windows, ner, layout, backend).encode('ascii'))
+    return digest.hexdigest()
+
+def _read_cache_entry(path: str) -> Optional[Dict]:
+    """Read one JSON cache entry, treating missing or corrupt files as absent."""
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def _write_cache_entry(path: str, entry: Dict):
+    """Write one JSON cache entry atomically; a cache that cannot be written is only logged."""
+    # Write then rename so concurrent readers never see a partial entry
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(entry, file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Could not write cache entry %s: %s", path, e)
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+
+def load_cached_result(cache_dir: str, key: str) -> Optional[Dict]:
+    """Load cached text and entities for a cache key, if present and readable."""
+    return _read_cache_entry(os.path.join(cache_dir, key + '.json'))
+
+def save_cached_result(cache_dir: str, key: str, document: PdfText, entities: List[Dict]):
+    """Store extracted text, page offsets and entities under a cache key.
     
-    print(f"\n✓ Results saved to {output_path}")
+    Text from a read that failed partway is not stored, so the next run retries it.
+    """
+    if not document.complete:
+        logger.warning("Not caching %s: text extraction did not finish", key)
+        return
+    _write_cache_entry(os.path.join(cache_dir, key + '.json'), {
+        'text': document.text,
+        'page_offsets': document.page_offsets,
+        'entities': entities
+    })
+
+# Resource entries that cannot change extracted text: embedded font programs
+# (glyph shapes only) and back-references up the page tree
+RESOURCE_HASH_SKIP = {'/FontFile', '/FontFile2', '/FontFile3', '/Parent'}
 
-def main():
-    # Configuration
-    pdf_path = "PDF for Python LLM (1).pdf"
-    output_csv = "extracted_entities.csv"
+def _resource_digest(obj, memo: Dict) -> bytes:
+    """Digest of a PDF object and everything it references, skipping image data.
+    
+    Indirect objects are digested once per document via memo, so fonts
+    shared by many pages are hashed once.
+    """
+    from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+    
+    if isinstance(obj, IndirectObject):
+        key = (obj.idnum, obj.generation)
+        if key not in memo:
+            memo[key] = b''  # Placeholder breaks reference cycles
+            memo[key] = _resource_digest(obj.get_object(), memo)
+        return memo[key]
+    
+    digest = hashlib.sha256()
+    if isinstance(obj, DictionaryObject):
+        for name in sorted(obj):
+            if name not in RESOURCE_HASH_SKIP:
+                digest.update(name.encode('utf-8', 'replace'))
+                digest.update(_resource_digest(obj.raw_get(name), memo))
+        if isinstance(obj, StreamObject) and obj.get('/Subtype') != '/Image':
+            try:
+                digest.update(obj.get_data())
+            except Exception:
+                digest.update(obj._data)
+    elif isinstance(obj, ArrayObject):
+        for item in obj:
+            digest.update(_resource_digest(item, memo))
+    else:
+        digest.update(repr(obj).encode('utf-8', 'replace'))
+    return digest.digest()
+
+def _page_content_hash(page, memo: Optional[Dict] = None) -> str:
+    """Hash a PDF page's content stream and resources, which change whenever its text does.
+    
+    Fonts are included because the same glyph codes decode to different
+    text under a different encoding or ToUnicode map, and the page cache is
+    shared by every PDF.
+    """
+    contents = page.get_contents()
+    digest = hashlib.sha256(contents.get_data() if contents is not None else b'')
+    if '/Resources' in page:
+        digest.update(_resource_digest(page.raw_get('/Resources'), {} if memo is None else memo))
+    return digest.hexdigest()
+
+def _page_cache_path(cache_dir: str, page_hash: str, mode: str) -> str:
+    """Cache file for one page's text as extracted in a mode (backend name or 'layout')."""
+    return os.path.join(cache_dir, 'pages', f"{page_hash}.{mode}.v{EXTRACTOR_VERSION}.json")
+
+def extract_pages_cached(pdf_path: str, cache_dir: str = CACHE_DIR, backend: str = DEFAULT_PDF_BACKEND,
+                         layout: bool = False, progress: Union[bool, ProgressCallback] = False,
+                         metrics: Optional[ExtractionMetrics] = None, workers: int = 1
+                         ) -> Tuple[List[str], List[str], List[Dict[str, Tuple[str, str]]]]:
+    """Return page texts, content hashes and table-row links, extracting only pages not in the cache.
+    
+    Pages are cached by content hash and extraction mode (backend, or
+    layout); table-row links are read only in layout mode. With
+    workers > 1, missing page ranges are extracted in a process pool.
+    """
+    import PyPDF2
+    
+    if metrics is None:
+        metrics = ExtractionMetrics()
+    pdf_backend = get_pdf_backend(backend)
+    mode = 'layout' if layout else pdf_backend.name
+    entries, hashes, missing = [], [], []
+    memo = {}
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        total = len(pdf_reader.pages)
+        if progress is True:
+            print(f"  Total pages: {total} (unchanged pages come from the page cache)")
+        for index, page in enumerate(pdf_reader.pages):
+            page_hash = _page_content_hash(page, memo)
+            path = _page_cache_path(cache_dir, page_hash, mode)
+            entry = _read_cache_entry(path)
+            if entry is not None:
+                metrics.increment('page_cache_hits')
+            elif layout:
+                with metrics.stage('extract_layout'):
+                    text, fragments = extract_page_layout(page)
+                    entry = {'text': text, 'links': link_table_rows(group_table_rows(fragments))}
+                _write_cache_entry(path, entry)
+            else:
+                missing.append(index)
+            entries.append(entry)
+            hashes.append(page_hash)
+    
+    # The backend opens the PDF itself; read runs of consecutive missing pages in one pass each
+    tasks = []
+    for _, run in itertools.groupby(enumerate(missing), lambda item: item[1] - item[0]):
+        indices = [index for _, index in run]
+        tasks.extend((pdf_path, start, min(start + PAGES_PER_TASK, indices[-1] + 1), pdf_backend.name)
+                     for start in range(indices[0], indices[-1] + 1, PAGES_PER_TASK))
+    with metrics.stage('extract_text'):
+        if workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_extract_page_range, tasks))
+        else:
+            results = [_extract_page_range(task) for task in tasks]
+    for (_, start, _, _), texts in zip(tasks, results):
+        for index, text in enumerate(texts, start):
+            entries[index] = {'text': text}
+            _write_cache_entry(_page_cache_path(cache_dir, hashes[index], mode), entries[index])
+    
+    if None in entries:
+        raise ValueError(f"page {entries.index(None) + 1} of {total} could not be extracted")
+    metrics.increment('pages', total)
+    if callable(progress):
+        progress('pages', total, total)
+    pages = [entry['text'] for entry in entries]
+    links = [{pan: tuple(link) for pan, link in entry.get('links', {}).items()} for entry in entries]
+    return pages, hashes, links
+
+def _link_page(pages: List[str], index: int, nlp, matcher: Optional[CounterpartyMatcher] = None,
+               metrics: Optional[ExtractionMetrics] = None, batch_size: int = NER_BATCH_SIZE,
+               n_process: int = NER_N_PROCESS, context_windows: Tuple[int, ...] = CONTEXT_WINDOWS,
+               ner: bool = True, known_links: Optional[Dict[str, Tuple[str, str]]] = None) -> List[List]:
+    """Link the PANs mentioned on one page, using neighbouring pages as context."""
+    overlap = stream_overlap(context_windows)
+    before = pages[index - 1][-overlap:] + "\n" if index > 0 else ""
+    after = "\n" + pages[index + 1][:overlap] if index + 1 < len(pages) else ""
+    text = before + pages[index] + after
+    
+    positions = find_pan_positions(text, len(before), len(before) + len(pages[index]), first_page=index + 1)
+    if not positions:
+        return []
+    links = link_pans(text, positions, nlp, batch_size=batch_size, n_process=n_process, matcher=matcher,
+                      metrics=metrics, context_windows=context_windows, ner=ner, known_links=known_links)
+    return [[pan, *links.get(pan, (None, None))] for pan in positions]
+
+def merge_into_csv(entities: List[Dict], output_path: str, relinked: Iterable[str] = ()) -> int:
+    """Merge a document's current relations into an existing CSV.
+    
+    PANs no longer in entities are dropped. Rows for PANs in relinked (those
+    found on new or changed pages) are replaced; other existing rows are
+    kept unless they are unmatched, and new PANs are appended.
+    """
+    relinked = set(relinked)
+    rows = {}
+    if os.path.exists(output_path):
+        with open(output_path, newline='', encoding='utf-8') as csvfile:
+            for row in csv.DictReader(csvfile):
+                rows[row['Entity_Value']] = {
+                    'entity_type': row['Entity_Type'],
+                    'value': row['Entity_Value'],
+                    'relation': row['Relation'],
+                    'related_entity_type': row['Related_Entity_Type'],
+                    'related_entity': row['Related_Entity']
+                }
+    
+    merged = {}
+    for entity in entities:
+        existing = rows.get(entity['value'])
+        if existing is None or existing['related_entity'] == 'Not Found' or entity['value'] in relinked:
+            existing = entity
+        merged[entity['value']] = existing
+    
+    return save_to_csv(merged.values(), output_path)
+
+def process_pdf_incremental(pdf_path: str, output_csv: str, cache_dir: str = CACHE_DIR, nlp=None,
+                            matcher: Optional[CounterpartyMatcher] = None,
+                            metrics: Optional[ExtractionMetrics] = None, batch_size: int = NER_BATCH_SIZE,
+                            n_process: int = NER_N_PROCESS, context_windows: Tuple[int, ...] = CONTEXT_WINDOWS,
+                            ner: bool = True, layout: bool = False, backend: str = DEFAULT_PDF_BACKEND,
+                            progress: Union[bool, ProgressCallback] = False) -> Dict:
+    """Re-extract and re-link only new or changed pages, then merge into the CSV.
+    
+    Page text is cached by a hash of the page's content stream and
+    resources. Linking results are cached per page together with its
+    neighbours' hashes, since context windows reach across page breaks.
+    """
+    pages, hashes, table_links = extract_pages_cached(pdf_path, cache_dir, backend, layout, progress, metrics)
+    fingerprint = _extraction_fingerprint(matcher, context_windows, ner, layout, backend)
+    options = {'batch_size': batch_size, 'n_process': n_process, 'context_windows': context_windows, 'ner': ner}
+    
+    links = {}
+    relinked = 0
+    relinked_pans = set()
+    for index, page_hash in enumerate(hashes):
+        previous_hash = hashes[index - 1] if index > 0 else ''
+        next_hash = hashes[index + 1] if index + 1 < len(hashes) else ''
+        key_parts = [fingerprint, previous_hash, page_hash, next_hash]
+        key = hashlib.sha256("|".join(key_parts).encode('ascii')).hexdigest()
+        path = os.path.join(cache_dir, 'links', key + '.json')
+        entry = _read_cache_entry(path)
+        if entry is None:
+            entry = {'links': _link_page(pages, index, nlp, matcher, metrics, known_links=table_links[index],
+                                         **options)}
+            _write_cache_entry(path, entry)
+            relinked += 1
+            relinked_pans.update(pan for pan, _, _ in entry['links'])
+        
+        # The first page that links a PAN wins, as in the streaming pipeline
+        for pan, entity_name, entity_type in entry['links']:
+            if not links.get(pan, (None, None))[0]:
+                links[pan] = (entity_name, entity_type)
+    
+    entities = [make_relation(pan, *link) for pan, link in links.items()]
+    merge_into_csv(entities, output_csv, relinked_pans)
+    if metrics is not None:
+        metrics.increment('pans_found', len(entities))
+        metrics.increment('unmatched', sum(1 for entity in entities if entity['related_entity'] == 'Not Found'))
+    return {'pages': len(pages), 'relinked_pages': relinked, 'entities': len(entities)}
+
+class Extractor:
+    """Silent library interface to the extraction pipeline.
+    
+    Nothing is printed: progress goes only to the optional
+    progress(stage, done, total) callback and diagnostics to the
+    'extract_entities' logger, so hot loops do no console I/O.
+    """
+    
+    def __init__(self, nlp=None, matcher: Optional[CounterpartyMatcher] = None,
+                 counterparties: Optional[str] = None, workers: int = 1,
+                 batch_size: int = NER_BATCH_SIZE, n_process: int = NER_N_PROCESS,
+                 cache_dir: Optional[str] = None, progress: Optional[ProgressCallback] = None,
+                 metrics: Optional[ExtractionMetrics] = None,
+                 context_windows: Tuple[int, ...] = CONTEXT_WINDOWS, ner: bool = True, layout: bool = False,
+                 backend: str = DEFAULT_PDF_BACKEND):
+        if matcher is None and counterparties:
+            matcher = load_counterparty_matcher(counterparties)
+        self.matcher = matcher
+        self.workers = workers
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.cache_dir = cache_dir
+        self.progress = progress
+        self.context_windows = context_windows
+        self.ner = ner
+        self.layout = layout
+        self.backend = get_pdf_backend(backend).name
+        self.metrics = metrics if metrics is not None else ExtractionMetrics()
+        self._nlp = nlp
+    
+    @property
+    def nlp(self):
+        """The spaCy pipeline, loaded on first use.
+        
+        Extraction itself loads the model only when patterns and known
+        counterparties leave PANs unresolved.
+        """
+        if self._nlp is None:
+            with self.metrics.stage('load_model'):
+                self._nlp = load_nlp()
+        return self._nlp
+    
+    def _report(self, stage: str, done: int, total: int):
+        if self.progress is not None:
+            self.progress(stage, done, total)
+    
+    def extract_document(self, pdf_path: str) -> PdfText:
+        """Extract text and page offsets from a PDF."""
+        document = extract_pdf_document(pdf_path, self._report, self.workers, self.metrics, self.backend,
+                                        self.cache_dir)
+        logger.debug("Extracted %d characters from %s", len(document.text), pdf_path)
+        return document
+    
+    def link_text(self, text: str, known_links: Optional[Dict[str, Tuple[str, str]]] = None,
+                  page_offsets: Optional[List[Tuple[int, int]]] = None) -> List[Dict]:
+        """Find the PANs in text and link each one to its related entity."""
+        entities = link_document_text(text, self._nlp, batch_size=self.batch_size, n_process=self.n_process,
+                                      matcher=self.matcher, metrics=self.metrics,
+                                      context_windows=self.context_windows, ner=self.ner, known_links=known_links,
+                                      page_offsets=page_offsets)
+        if entities:
+            linked = sum(1 for entity in entities if entity['related_entity_type'] != 'Unknown')
+            self._report('linking', len(entities), len(entities))
+            logger.debug("Linked %d of %d PANs", linked, len(entities))
+        return entities
+    
+    def extract(self, pdf_path: str) -> List[Dict]:
+        """Extract PAN relations from a PDF, reusing cached results when cache_dir is set."""
+        if self.cache_dir and os.path.exists(pdf_path):
+            key = result_cache_key(pdf_path, self.matcher, self.context_windows, self.ner, self.layout,
+                                   self.backend)
+        else:
+            key = None
+        cached = load_cached_result(self.cache_dir, key) if key else None
+        if cached:
+            self.metrics.increment('cache_hits')
+            logger.debug("Loaded cached results for %s", pdf_path)
+            return cached['entities']
+        
+        if self.layout:
+            document, table_links = extract_pdf_layout(pdf_path, self._report, self.metrics, self.cache_dir)
+            logger.debug("Linked %d PANs from table rows in %s", len(table_links), pdf_path)
+        else:
+            document, table_links = self.extract_document(pdf_path), None
+        if not document.text:
+            logger.warning("No text extracted from %s", pdf_path)
+            return []
+        entities = self.link_text(document.text, table_links, document.page_offsets)
+        if key:
+            save_cached_result(self.cache_dir, key, document, entities)
+        return entities
+    
+    def extract_incremental(self, pdf_path: str, output_csv: str) -> Dict:
+        """Re-link only new or changed pages of a PDF and merge the results into output_csv."""
+        if not self.cache_dir:
+            raise ValueError("incremental extraction needs a cache_dir")
+        stats = process_pdf_incremental(pdf_path, output_csv, self.cache_dir, self._nlp, self.matcher, self.metrics,
+                                        batch_size=self.batch_size, n_process=self.n_process,
+                                        context_windows=self.context_windows, ner=self.ner, layout=self.layout,
+                                        backend=self.backend, progress=self._report)
+        logger.debug("Re-linked %d of %d pages of %s", stats['relinked_pages'], stats['pages'], pdf_path)
+        return stats
+    
+    def stream(self, pdf_path: str) -> Iterator[Dict]:
+        """Stream PAN relations from a PDF page by page with bounded memory.
+        
+        Layout mode reads table rows from the whole document first, so it
+        yields the results of extract() instead.
+        """
+        if self.layout:
+            return iter(self.extract(pdf_path))
+        return stream_entities(pdf_path, self._nlp, progress=self._report,
+                               workers=self.workers, batch_size=self.batch_size, n_process=self.n_process,
+                               matcher=self.matcher, metrics=self.metrics, context_windows=self.context_windows,
+                               ner=self.ner, backend=self.backend)
+    
+    def save(self, entities: Iterable[Dict], output_path: str, output_format: str = 'csv',
+             include_source: bool = False) -> int:
+        """Write relations in one of OUTPUT_FORMATS and return the number of rows."""
+        count = save_entities(entities, output_path, output_format, include_source=include_source,
+                              metrics=self.metrics)
+        logger.info("Saved %d rows to %s", count, output_path)
+        return count
+
+def find_pdf_files(source: str) -> List[str]:
+    """List PDFs under a directory, or the paths named in a manifest file."""
+    if os.path.isdir(source):
+        pdf_paths = []
+        for root, _, files in os.walk(source):
+            pdf_paths.extend(os.path.join(root, name) for name in files if name.lower().endswith('.pdf'))
+        return sorted(pdf_paths)
+    
+    # Manifest: one path per line, relative to the manifest; '#' starts a comment
+    base_dir = os.path.dirname(os.path.abspath(source))
+    pdf_paths = []
+    with open(source, encoding='utf-8') as manifest:
+        for line in manifest:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                pdf_paths.append(os.path.join(base_dir, line))
+    return pdf_paths
+
+def _init_batch_worker(counterparties: Optional[str] = None):
+    """Worker initializer: load the counterparty list once per worker.
+    
+    The spaCy model is loaded on first need and then cached per worker.
+    """
+    if counterparties:
+        load_counterparty_matcher(counterparties)
+
+def _process_pdf_file(pdf_path: str, cache_dir: Optional[str] = None,
+                      counterparties: Optional[str] = None, batch_size: int = NER_BATCH_SIZE,
+                      context_windows: Tuple[int, ...] = CONTEXT_WINDOWS,
+                      ner: bool = True, layout: bool = False,
+                      backend: str = DEFAULT_PDF_BACKEND,
+                      n_process: int = NER_N_PROCESS) -> Tuple[List[Dict], Dict]:
+    """Extract PAN relations from one PDF, tagged with the source file, and its metrics."""
+    metrics = ExtractionMetrics()
+    try:
+        matcher = load_counterparty_matcher(counterparties) if counterparties else None
+        options = {'batch_size': batch_size, 'n_process': n_process, 'matcher': matcher, 'metrics': metrics,
+                   'context_windows': context_windows, 'ner': ner}
+        if cache_dir and os.path.exists(pdf_path):
+            key = result_cache_key(pdf_path, matcher, context_windows, ner, layout, backend)
+        else:
+            key = None
+        cached = load_cached_result(cache_dir, key) if key else None
+        if cached:
+            metrics.increment('cache_hits')
+            entities = cached['entities']
+        elif layout:
+            # Table rows come from the whole document, so there is nothing to stream
+            document, table_links = extract_pdf_layout(pdf_path, progress=False, metrics=metrics, cache_dir=cache_dir)
+            entities = link_document_text(document.text, known_links=table_links, page_offsets=document.page_offsets,
+                                          **options)
+            if key and document.text:
+                save_cached_result(cache_dir, key, document, entities)
+        elif key:
+            # The cache stores the full text, so extract the document in one piece
+            document = extract_pdf_document(pdf_path, progress=False, metrics=metrics, backend=backend,
+                                            cache_dir=cache_dir)
+            entities = link_document_text(document.text, page_offsets=document.page_offsets, **options)
+            if document.text:
+                save_cached_result(cache_dir, key, document, entities)
+        else:
+            entities = list(stream_entities(pdf_path, progress=False, backend=backend, **options))
+    except Exception as e:
+        # One bad file must not abort a batch over thousands of others
+        logger.error("Skipping %s: %s", pdf_path, e)
+        metrics.increment('failed_files')
+        entities = []
+    
+    for entity in entities:
+        entity['source_file'] = pdf_path
+    return entities, metrics.to_dict()
+
+def per_file_output_paths(pdf_paths: List[str], output_dir: str, output_format: str) -> List[str]:
+    """Output path for each PDF, mirroring its path below the inputs' common directory.
+    
+    PDFs with the same name in different directories get separate files;
+    any name still taken (e.g. 'a.pdf' beside 'a.PDF') gets a numeric suffix.
+    """
+    abs_paths = [os.path.abspath(pdf_path) for pdf_path in pdf_paths]
+    root = os.path.commonpath([os.path.dirname(path) for path in abs_paths]) if abs_paths else ''
+    outputs = []
+    taken = set()
+    for path in abs_paths:
+        base = os.path.join(output_dir, os.path.splitext(os.path.relpath(path, root))[0])
+        output = f"{base}.{output_format}"
+        suffix = 2
+        while os.path.normcase(output) in taken:
+            output = f"{base}_{suffix}.{output_format}"
+            suffix += 1
+        taken.add(os.path.normcase(output))
+        outputs.append(output)
+    return outputs
+
+def process_pdf_batch(pdf_paths: List[str], output_path: str, per_file: bool = False,
+                      workers: int = 1, cache_dir: Optional[str] = None,
+                      counterparties: Optional[str] = None, output_format: str = 'csv',
+                      batch_size: int = NER_BATCH_SIZE, context_windows: Tuple[int, ...] = CONTEXT_WINDOWS,
+                      ner: bool = True, layout: bool = False, backend: str = DEFAULT_PDF_BACKEND,
+                      n_process: int = NER_N_PROCESS) -> Dict:
+    """Process many PDFs across a worker pool and write combined or per-file output.
+    
+    In per-file mode output_path is a directory receiving one file per PDF,
+    laid out as in per_file_output_paths; otherwise all rows go to a single file with a Source_File column.
+    """
+    start_time = time.monotonic()
+    if counterparties:
+        # Build a stale automaton once here, not in every worker at the same time
+        load_counterparty_matcher(counterparties)
+    process_file = functools.partial(_process_pdf_file, cache_dir=cache_dir, counterparties=counterparties,
+                                     batch_size=batch_size, context_windows=context_windows, ner=ner,
+                                     layout=layout, backend=backend, n_process=n_process)
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                       initargs=(counterparties,))
+        results = executor.map(process_file, pdf_paths)
+    else:
+        executor = None
+        results = map(process_file, pdf_paths)
+    
+    stats = {'files': 0, 'entities': 0}
+    metrics = ExtractionMetrics()
+    
+    def counted(results):
+        for entities, file_metrics in results:
+            stats['files'] += 1
+            stats['entities'] += len(entities)
+            metrics.merge(file_metrics)
+            yield entities
+    
+    try:
+        # Results arrive in input order while later files are still being processed
+        if per_file:
+            for file_output, entities in zip(per_file_output_paths(pdf_paths, output_path, output_format),
+                                             counted(results)):
+                os.makedirs(os.path.dirname(file_output) or '.', exist_ok=True)
+                save_entities(entities, file_output, output_format, include_source=True, metrics=metrics)
+        else:
+            rows = (entity for entities in counted(results) for entity in entities)
+            save_entities(rows, output_path, output_format, include_source=True, metrics=metrics)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    
+    stats['seconds'] = time.monotonic() - start_time
+    stats['files_per_sec'] = stats['files'] / stats['seconds'] if stats['seconds'] else 0.0
+    stats['unmatched'] = metrics.counters['unmatched']
+    stats['failed'] = metrics.counters['failed_files'] + metrics.counters['read_errors']
+    stats['metrics'] = metrics.to_dict()
+    return stats
+
+# PDF processed when no inputs are given on the command line
+DEFAULT_PDF = "PDF for Python LLM (1).pdf"
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    """Command-line options for extracting PAN relations from one or more PDFs."""
+    parser = argparse.ArgumentParser(description="Extract PAN numbers and their related entities from PDFs.")
+    parser.add_argument('inputs', nargs='*', default=[DEFAULT_PDF],
+                        help="PDF files, glob patterns, directories (searched recursively) or manifest files "
+                             f"listing one PDF per line (default: '{DEFAULT_PDF}')")
+    parser.add_argument('-o', '--output',
+                        help="output file, or directory with --per-file (default: extracted_entities.<format>)")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='csv', help="output format (default: csv)")
+    parser.add_argument('--per-file', action='store_true', help="write one output file per PDF into --output")
+    parser.add_argument('--workers', type=int,
+                        help="worker processes: PDFs in parallel for several inputs, page ranges for one "
+                             "(default: one per CPU for several inputs, 1 for one)")
+    parser.add_argument('--batch-size', type=int, default=NER_BATCH_SIZE,
+                        help=f"texts per spaCy nlp.pipe batch (default: {NER_BATCH_SIZE})")
+    parser.add_argument('--ner-processes', type=int, default=NER_N_PROCESS,
+                        help="spaCy worker processes per nlp.pipe call; each call starts its own pool, so this "
+                             f"pays off only for long documents (default: {NER_N_PROCESS})")
+    parser.add_argument('--window', type=int, default=CONTEXT_WINDOWS[0],
+                        help=f"context window in characters around each PAN; NER retries at twice this "
+                             f"(default: {CONTEXT_WINDOWS[0]})")
+    parser.add_argument('--no-ner', action='store_true',
+                        help="pattern-only fast mode: link by relation patterns and known counterparties and "
+                             "never load spaCy; unresolved PANs are reported")
+    parser.add_argument('--layout', action='store_true',
+                        help="read table rows from text positions and link each PAN to the name cell in its row")
+    parser.add_argument('--backend', choices=list(PDF_BACKENDS), default=DEFAULT_PDF_BACKEND,
+                        help=f"PDF text extraction library; pypdfium2 and pdfminer must be installed separately "
+                             f"(default: {DEFAULT_PDF_BACKEND}; --layout always uses pypdf2)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="re-extract and re-link only new or changed pages and merge the results into the "
+                             "existing CSV output (needs the cache; --per-file for several PDFs)")
+    parser.add_argument('--counterparties', help="master list of known names, one 'name<TAB>type' per line")
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help=f"result cache directory; pass '' to disable (default: {CACHE_DIR})")
+    parser.add_argument('--metrics', help="write stage timings and counters here (.prom/.txt: Prometheus, else JSON)")
+    parser.add_argument('--profile', nargs='?', const='', metavar='FILE',
+                        help="run under cProfile and print the top functions; save raw stats to FILE if given "
+                             "(the main process only)")
+    return parser
+
+def expand_inputs(inputs: List[str]) -> List[str]:
+    """Resolve globs, directories and manifest files into a list of PDF paths."""
+    pdf_paths = []
+    for source in inputs:
+        if glob.has_magic(source):
+            pdf_paths.extend(sorted(glob.glob(source, recursive=True)))
+        elif os.path.isdir(source) or (os.path.isfile(source) and not source.lower().endswith('.pdf')):
+            pdf_paths.extend(find_pdf_files(source))
+        else:
+            pdf_paths.append(source)
+    return pdf_paths
+
+def run_batch(pdf_paths: List[str], args: argparse.Namespace, output_path: str):
+    """Process many PDFs, printing a throughput summary."""
+    workers = args.workers or os.cpu_count() or 1
+    print(f"Processing {len(pdf_paths)} PDF files with {workers} workers...")
+    stats = process_pdf_batch(pdf_paths, output_path, per_file=args.per_file, workers=workers,
+                              cache_dir=args.cache_dir or None, counterparties=args.counterparties,
+                              output_format=args.format, batch_size=args.batch_size, n_process=args.ner_processes,
+                              context_windows=context_windows_for(args.window), ner=not args.no_ner,
+                              layout=args.layout, backend=args.backend)
+    print(f"✓ {stats['files']} files, {stats['entities']} PAN relations ({stats['unmatched']} unresolved) "
+          f"in {stats['seconds']:.1f}s ({stats['files_per_sec']:.2f} files/sec), saved to {output_path}")
+    if stats['failed']:
+        print(f"  ⚠ {stats['failed']} of {stats['files']} files could not be read completely")
+    for stage, seconds in stats['metrics']['timers_seconds'].items():
+        print(f"  {stage:<20} {seconds:8.3f}s")
+    if args.metrics:
+        metrics = ExtractionMetrics()
+        metrics.merge(stats['metrics'])
+        metrics.dump(args.metrics)
+
+def run_incremental(pdf_paths: List[str], args: argparse.Namespace, output_path: str):
+    """Merge the new or changed pages of each PDF into its existing CSV, printing what was re-linked."""
+    metrics = ExtractionMetrics()
+    matcher = load_counterparty_matcher(args.counterparties) if args.counterparties else None
+    outputs = per_file_output_paths(pdf_paths, output_path, 'csv') if args.per_file else [output_path]
+    for pdf_path, output in zip(pdf_paths, outputs):
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        stats = process_pdf_incremental(pdf_path, output, args.cache_dir, matcher=matcher, metrics=metrics,
+                                        batch_size=args.batch_size, n_process=args.ner_processes,
+                                        context_windows=context_windows_for(args.window), ner=not args.no_ner,
+                                        layout=args.layout, backend=args.backend)
+        print(f"✓ {pdf_path}: re-linked {stats['relinked_pages']} of {stats['pages']} pages, "
+              f"{stats['entities']} PANs saved to {output}")
+    for stage, seconds in metrics.timers.items():
+        print(f"  {stage:<20} {seconds:8.3f}s")
+    if args.metrics:
+        metrics.dump(args.metrics)
+
+def run_single(pdf_path: str, args: argparse.Namespace, output_path: str):
+    """Process one PDF with step-by-step console output."""
+    cache_dir = args.cache_dir or None
+    context_windows = context_windows_for(args.window)
+    ner = not args.no_ner
     
     print("="*70)
     print(" Entity and Relation Extraction System (Lightweight Version)")
     print("="*70)
     
-    # Step 1: Extract text from PDF
-    print("\n[1] Extracting text from PDF...")
-    text = extract_text_from_pdf(pdf_path)
-    
-    if not text:
-        print("❌ Error: No text extracted from PDF!")
-        return
-    
-    print(f"\n  ✓ Extracted {len(text)} characters from PDF")
+    metrics = ExtractionMetrics()
+    matcher = load_counterparty_matcher(args.counterparties) if args.counterparties else None
     
-    # Step 2-4: Process entities
-    entities = process_entities(text)
+    # Reuse results from an earlier run on the same PDF content
+    if cache_dir and os.path.exists(pdf_path):
+        cache_key = result_cache_key(pdf_path, matcher, context_windows, ner, args.layout, args.backend)
+    else:
+        cache_key = None
+    cached = load_cached_result(cache_dir, cache_key) if cache_key else None
+    if cached:
+        print(f"\n[1-3] Loaded cached results ({len(cached['text'])} characters)")
+        metrics.increment('cache_hits')
+        entities = cached['entities']
+    else:
+        # Step 1: Extract text from PDF
+        print("\n[1] Extracting text from PDF...")
+        table_links = None
+        if args.layout:
+            document, table_links = extract_pdf_layout(pdf_path, metrics=metrics, cache_dir=cache_dir)
+        else:
+            document = extract_pdf_document(pdf_path, workers=args.workers or 1, metrics=metrics,
+                                            backend=args.backend, cache_dir=cache_dir)
+        text = document.text
+        
+        if not text:
+            print("❌ Error: No text extracted from PDF!")
+            return
+        
+        print(f"\n  ✓ Extracted {len(text)} characters from PDF")
+        if table_links is not None:
+            print(f"  ✓ Read {len(table_links)} PAN links from table rows")
+        
+        # Step 2-3: Process entities
+        entities = process_entities(text, batch_size=args.batch_size, n_process=args.ner_processes, matcher=matcher,
+                                    metrics=metrics, context_windows=context_windows, ner=ner,
+                                    known_links=table_links, page_offsets=document.page_offsets)
+        if cache_key:
+            save_cached_result(cache_dir, cache_key, document, entities)
     
-    # Step 5: Save to CSV
-    print("\n[5] Saving results to CSV...")
-    save_to_csv(entities, output_csv)
+    # Step 4: Save results
+    print("\n[4] Saving results...")
+    save_entities(entities, output_path, args.format, metrics=metrics)
+    print(f"\n✓ Results saved to {output_path}")
     
     # Display summary
     print("\n" + "="*70)
@@ -254,9 +2167,63 @@ def main():
     if len(entities) > 10:
         print(f"... and {len(entities) - 10} more entities")
     
+    print("\n⏱ Stage timings:")
+    for stage, seconds in metrics.timers.items():
+        print(f"  {stage:<20} {seconds:8.3f}s")
+    if args.metrics:
+        metrics.dump(args.metrics)
+        print(f"✓ Metrics saved to '{args.metrics}'")
+    
     print("="*70)
-    print(f"✓ COMPLETE! Check '{output_csv}' for full results")
+    print(f"✓ COMPLETE! Check '{output_path}' for full results")
     print("="*70)
 
+def main(argv: Optional[List[str]] = None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    if (args.window <= 0 or args.batch_size <= 0 or args.ner_processes <= 0
+            or (args.workers is not None and args.workers <= 0)):
+        parser.error("--window, --batch-size, --ner-processes and --workers must be positive")
+    if args.backend not in available_pdf_backends():
+        parser.error(f"--backend {args.backend} needs 'pip install {PDF_BACKENDS[args.backend].requirement}'")
+    pdf_paths = expand_inputs(args.inputs)
+    if not pdf_paths:
+        print("❌ Error: No PDF files found!")
+        return
+    
+    output_path = args.output or ("extracted_entities" if args.per_file else f"extracted_entities.{args.format}")
+    # A single PDF gets the step-by-step console run; anything else is a batch
+    batch = args.per_file or len(pdf_paths) > 1 or any(os.path.isdir(p) or glob.has_magic(p) for p in args.inputs)
+    if args.incremental:
+        if args.format != 'csv' or not args.cache_dir:
+            parser.error("--incremental merges into CSV output and needs --cache-dir")
+        if len(pdf_paths) > 1 and not args.per_file:
+            parser.error("--incremental with several PDFs needs --per-file")
+        run = functools.partial(run_incremental, pdf_paths, args, output_path)
+    else:
+        run = functools.partial(run_batch if batch else run_single, pdf_paths if batch else pdf_paths[0], args,
+                                output_path)
+    
+    if args.profile is None:
+        run()
+        return
+    
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.runcall(run)
+    if args.profile:
+        profiler.dump_stats(args.profile)
+    print("\n⏱ Profile (top 25 by cumulative time):")
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # PyPDF2 warns about every malformed object; keep the console readable.
+    # Only the script does this, so applications embedding the module keep their warnings.
+    warnings.filterwarnings('ignore')
+    try:
+        main()
+    except OSError as e:
+        # e.g. the spaCy model is not installed
+        print(f"❌ Error: {e}")
+        sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,379 @@
+import csv
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+import benchmark
+import extract_entities as ee
+
+@pytest.fixture
+def blank_nlp():
+    """A model-free pipeline: an entity_ruler tags two title-case words as PERSON, 'X Ltd' as ORG."""
+    spacy = pytest.importorskip("spacy")
+    nlp = spacy.blank("en")
+    ruler = nlp.add_pipe("entity_ruler")
+    ruler.add_patterns([
+        {"label": "PERSON", "pattern": [{"IS_TITLE": True}, {"IS_TITLE": True}]},
+        {"label": "ORG", "pattern": [{"IS_TITLE": True}, {"LOWER": "ltd"}]},
+    ])
+    return nlp
+
+class PipeSpy:
+    """Wraps a pipeline, recording the n_process of every nlp.pipe call and running it in-process."""
+
+    def __init__(self, nlp):
+        self.nlp = nlp
+        self.calls = []
+
+    def pipe(self, texts, n_process=1, **kwargs):
+        self.calls.append(n_process)
+        return self.nlp.pipe(texts, n_process=1, **kwargs)
+
+def per_pan_search(text, pan):
+    """The original linking: search each relation pattern for one PAN at a time."""
+    for pattern, entity_type in ee.RELATION_PATTERNS:
+        match = re.search(pattern.pattern.replace(ee.PAN_GROUP, re.escape(pan)), text, pattern.flags)
+        if match:
+            return match.group('entity').strip(), entity_type
+    return None, None
+
+def test_relation_patterns_link_adjacent_mentions():
+    text = "PAN: ABCDE1234F of Mr. Ravi Kumar and PAN: PQRST5678Z of Mr. Sunil Rao"
+    assert ee.match_relation_patterns(text)["PQRST5678Z"] == ("Sunil Rao", "Person")
+
+def test_relation_patterns_match_per_pan_search():
+    lines = [line for page in benchmark.synthetic_pages(5, 10, seed=1) for line in page]
+    lines.append("PAN: ABCDE1234F of Mr. Ravi Kumar and PAN: PQRST5678Z of Mr. Sunil Rao")
+    text = "\n".join(lines)
+    relations = ee.match_relation_patterns(text)
+    for pan in ee.extract_pan_numbers(text):
+        assert relations.get(pan, (None, None)) == per_pan_search(text, pan), pan
+
+def test_per_file_outputs_keep_same_named_pdfs_apart():
+    outputs = ee.per_file_output_paths(["d/a/statement.pdf", "d/b/statement.pdf", "d/b/x.pdf", "d/b/x.PDF"],
+                                       "out", "csv")
+    assert outputs == [f"out/{name}.csv" for name in ("a/statement", "b/statement", "b/x", "b/x_2")]
+
+def read_links(csv_path):
+    with open(csv_path, newline="", encoding="utf-8") as file:
+        return {row["Entity_Value"]: row["Related_Entity"] for row in csv.DictReader(file)}
+
+def test_incremental_run_replaces_changed_and_drops_removed_pans(tmp_path):
+    pdf_path, csv_path, cache_dir = str(tmp_path / "statement.pdf"), str(tmp_path / "out.csv"), str(tmp_path / "cache")
+    unchanged_page = ["Mrs. Meena Jain (PAN: LMNOP1234Q)"]
+    benchmark.write_pdf(pdf_path, [["PAN: ABCDE1234F of Mr. Ravi Kumar.", "PAN: PQRST5678Z of Mr. Anil Rao."],
+                                   unchanged_page])
+    ee.process_pdf_incremental(pdf_path, csv_path, cache_dir)
+    assert read_links(csv_path) == {"ABCDE1234F": "Ravi Kumar", "PQRST5678Z": "Anil Rao", "LMNOP1234Q": "Meena Jain"}
+
+    benchmark.write_pdf(pdf_path, [["PAN: ABCDE1234F of Mr. Sunil Rao."], unchanged_page])
+    ee.process_pdf_incremental(pdf_path, csv_path, cache_dir)
+    assert read_links(csv_path) == {"ABCDE1234F": "Sunil Rao", "LMNOP1234Q": "Meena Jain"}
+
+def test_page_hash_covers_fonts(tmp_path):
+    import PyPDF2
+
+    first, second = tmp_path / "first.pdf", tmp_path / "second.pdf"
+    benchmark.write_pdf(str(first), [["PAN: ABCDE1234F of Mr. Ravi Kumar"]])
+    second.write_bytes(first.read_bytes().replace(b"/Helvetica", b"/Helveticb"))
+    hashes = [ee._page_content_hash(PyPDF2.PdfReader(str(path)).pages[0]) for path in (first, second)]
+    assert hashes[0] != hashes[1]
+
+def test_pan_letters_are_ascii_only():
+    # IGNORECASE alone lets [A-Z] match the Kelvin sign, long s, dotless i and dotted I
+    for letter in "\u212a\u017f\u0131\u0130":
+        text = f"PAN {letter}BCDE1234F of Mr. Ravi Kumar."
+        assert ee.extract_pan_numbers(text) == []
+        assert ee.match_relation_patterns(text) == {}
+    assert ee.extract_pan_numbers("PAN kbcde1234f") == ["KBCDE1234F"]
+
+def test_counterparty_automaton_save_failure_is_not_fatal(tmp_path, monkeypatch):
+    names_path = tmp_path / "names.txt"
+    names_path.write_text("Everblink Trade Pvt Ltd\tOrganisation\n", encoding="utf-8")
+
+    def read_only(self, path):
+        raise PermissionError(13, "Permission denied", path)
+
+    monkeypatch.setattr(ee.CounterpartyMatcher, "save", read_only)
+    assert len(ee.load_counterparty_matcher(str(names_path))) == 1
+
+def test_truncated_counterparty_automaton_is_rebuilt(tmp_path):
+    names_path = tmp_path / "names.txt"
+    names_path.write_text("Everblink Trade Pvt Ltd\tOrganisation\n", encoding="utf-8")
+    ee.CounterpartyMatcher(ee.read_counterparties(str(names_path))).save(str(names_path) + ".automaton")
+    automaton = tmp_path / "names.txt.automaton"
+    automaton.write_bytes(automaton.read_bytes()[:20])
+    assert len(ee.load_counterparty_matcher(str(names_path))) == 1
+    assert len(ee.CounterpartyMatcher.load(str(automaton))) == 1
+    assert [path.name for path in tmp_path.iterdir() if path.suffix == ".tmp"] == []
+
+def test_import_leaves_warning_filters_alone():
+    # A fresh interpreter, since pytest manages warning filters itself
+    probe = "import warnings; before = list(warnings.filters); import extract_entities; print(warnings.filters == before)"
+    output = subprocess.run([sys.executable, "-c", probe], cwd=os.path.dirname(os.path.abspath(ee.__file__)),
+                            capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "True"
+
+def test_missing_spacy_model_raises_without_printing(capsys):
+    pytest.importorskip("spacy")
+    with pytest.raises(OSError, match="spacy download"):
+        ee.load_nlp("no_such_spacy_model")
+    assert capsys.readouterr() == ("", "")
+
+def test_layout_rows_keep_small_caps_names_whole():
+    # "MAHESHWARI PVT. LTD.": large initials, smaller letters, words one space glyph apart
+    fragments = [ee.TextFragment(text, x, 500.0, size, width, 3.34) for text, x, size, width in [
+        ("M", 111.74, 12.0, 10.04), ("AHESHWARI ", 121.7, 9.48, 60.78), ("P", 182.06, 12.0, 8.05),
+        ("VT", 190.1, 9.48, 12.19), (".", 202.3, 12.0, 3.37), ("L", 208.3, 12.0, 6.71),
+        ("TD", 215.0, 9.48, 12.57), ("AAACM9185B", 422.11, 12.0, 77.09)]]
+    assert ee.group_table_rows(fragments) == [["MAHESHWARI PVT. LTD", "AAACM9185B"]]
+
+def test_layout_links_on_sample_notice():
+    import PyPDF2
+
+    sample = os.path.join(os.path.dirname(os.path.abspath(ee.__file__)), "PDF for Python LLM (1).pdf")
+    if not os.path.exists(sample):
+        pytest.skip("sample PDF not present")
+    _, fragments = ee.extract_page_layout(PyPDF2.PdfReader(sample).pages[0])
+    links = ee.link_table_rows(ee.group_table_rows(fragments))
+    assert links["AAACM9185B"] == ("MAHESHWARI FINANCIAL SERVICES PVT. LTD.", "Organisation")
+    assert links["AAECA1487G"] == ("AUTOLITE AGENCIES PVT. LTD.", "Organisation")
+
+def test_incomplete_pdf_backend_fails_on_creation():
+    class PageCountOnly(ee.PdfBackend):
+        name = "incomplete"
+
+        def page_count(self, pdf_path):
+            return 0
+
+    with pytest.raises(TypeError):
+        PageCountOnly()
+
+def escalation_text():
+    """Three bare ledger PANs: one names its owner on the same line, one a line away, one further off."""
+    filler = "\n".join(f"{n} shares were transferred on the settlement date." for n in range(12))
+    return (f"Ravi Kumar ABCDE1234F\n{filler}\nSunil Rao\nPQRST5678Z held\n{filler}\n"
+            f"Anil Mehta is listed below.\n{filler[:150]}\nLMNOP1234Q\n{filler}")
+
+def test_ner_worker_pool_parses_once_per_text(blank_nlp):
+    text = escalation_text()
+    occurrences = ee.build_pan_index(text)
+    serial, pooled = PipeSpy(blank_nlp), PipeSpy(blank_nlp)
+    serial_links, pooled_links = {}, {}
+    ee._link_with_ner(text, list(occurrences), occurrences, serial_links, serial, n_process=1)
+    ee._link_with_ner(text, list(occurrences), occurrences, pooled_links, pooled, n_process=4)
+    assert len(serial.calls) > 1
+    assert pooled.calls == [4]
+    assert pooled_links == serial_links
+
+def test_text_windows_own_each_character_once():
+    pages = [f"page {n} " + "x" * (37 * n) for n in range(1, 9)]
+    windows = list(ee.iter_text_windows(pages, overlap=40))
+    owned = "".join(window.text[window.start:window.end] for window in windows)
+    assert owned == "".join(page + "\n" for page in pages)
+    offset = 0
+    for window in windows:
+        assert window.start >= min(40, offset)
+        offset += window.end - window.start
+    assert all(len(window.text) - window.end >= 40 for window in windows[:-1])
+
+def test_pan_across_window_boundary_is_linked_once():
+    pages = ["Mr. Ravi Kumar (PAN: ABCDE1234F) " + "z" * 60, "Mr. Sunil Rao (PAN: ABCDE1234F) " + "z" * 60]
+    rows = list(ee.iter_linked_entities(ee.iter_text_windows(pages, overlap=40), ner=False))
+    assert [(row["value"], row["related_entity"]) for row in rows] == [("ABCDE1234F", "Ravi Kumar")]
+
+def test_batch_links_whole_text_like_single_mode(tmp_path):
+    pdf_path, names_path = str(tmp_path / "ledger.pdf"), tmp_path / "names.txt"
+    names_path.write_text("Globex Trading Ltd\tOrganisation\n", encoding="utf-8")
+    filler = [f"{n} shares were transferred on the settlement date." for n in range(30)]
+    benchmark.write_pdf(pdf_path, [["Globex Trading Ltd ABCDE1234F"] + filler + ["Mr. Ravi Kumar (PAN: ABCDE1234F)."]])
+    matcher = ee.load_counterparty_matcher(str(names_path))
+    single = ee.process_entities(ee.extract_pdf_document(pdf_path, progress=False).text, matcher=matcher, ner=False)
+    batch, _ = ee._process_pdf_file(pdf_path, cache_dir=str(tmp_path / "cache"), counterparties=str(names_path),
+                                    ner=False)
+    assert [entity["related_entity"] for entity in single] == ["Ravi Kumar"]
+    assert [entity["related_entity"] for entity in batch] == ["Ravi Kumar"]
+
+def test_batch_survives_missing_files_and_unwritable_cache(tmp_path):
+    pdf_path, output_path = str(tmp_path / "statement.pdf"), str(tmp_path / "out.csv")
+    benchmark.write_pdf(pdf_path, [["PAN: ABCDE1234F of Mr. Ravi Kumar."]])
+    blocked = tmp_path / "blocked"
+    blocked.write_text("")
+    stats = ee.process_pdf_batch([str(tmp_path / "missing.pdf"), pdf_path], output_path,
+                                 cache_dir=str(blocked / "cache"), ner=False)
+    assert stats["files"] == 2 and stats["failed"] == 1
+    assert read_links(output_path) == {"ABCDE1234F": "Ravi Kumar"}
+
+def test_partial_text_is_not_cached(tmp_path, monkeypatch):
+    pdf_path, cache_dir = str(tmp_path / "statement.pdf"), str(tmp_path / "cache")
+    benchmark.write_pdf(pdf_path, [["PAN: ABCDE1234F of Mr. Ravi Kumar."], ["PAN: PQRST5678Z of Mr. Anil Rao."]])
+    backend = ee.get_pdf_backend(ee.DEFAULT_PDF_BACKEND)
+    original = type(backend).iter_pages
+
+    def fail_after_first_page(self, path, start=0, end=None):
+        pages = original(self, path, start, end)
+        yield next(pages)
+        raise ValueError("damaged xref")
+
+    monkeypatch.setattr(type(backend), "iter_pages", fail_after_first_page)
+    document = ee.extract_pdf_document(pdf_path, progress=False)
+    assert "ABCDE1234F" in document.text and not document.complete
+    _, metrics = ee._process_pdf_file(pdf_path, cache_dir=cache_dir, ner=False)
+    assert metrics["counters"]["read_errors"] == 1
+    assert list((tmp_path / "cache").glob("*.json")) == []
+
+def test_page_cache_extracts_only_appended_pages(tmp_path):
+    pdf_path, cache_dir = str(tmp_path / "statement.pdf"), str(tmp_path / "cache")
+    pages = [["PAN: ABCDE1234F of Mr. Ravi Kumar."], ["PAN: PQRST5678Z of Mr. Anil Rao."]]
+    benchmark.write_pdf(pdf_path, pages)
+    first = ee.extract_pdf_document(pdf_path, progress=False, cache_dir=cache_dir)
+    assert first.text == ee.extract_text_from_pdf(pdf_path, progress=False)
+
+    benchmark.write_pdf(pdf_path, pages + [["PAN: LMNOP1234Q of Mrs. Meena Jain."]])
+    metrics = ee.ExtractionMetrics()
+    appended = ee.extract_pdf_document(pdf_path, progress=False, metrics=metrics, cache_dir=cache_dir)
+    assert appended.text.startswith(first.text) and "LMNOP1234Q" in appended.text
+    assert metrics.counters["page_cache_hits"] == 2
+
+def test_incremental_pattern_only_mode_never_loads_spacy(tmp_path, monkeypatch):
+    def fail():
+        raise AssertionError("spaCy loaded in pattern-only mode")
+
+    monkeypatch.setattr(ee, "load_nlp", fail)
+    pdf_path, csv_path = str(tmp_path / "statement.pdf"), str(tmp_path / "out.csv")
+    benchmark.write_pdf(pdf_path, [["PAN: ABCDE1234F of Mr. Ravi Kumar.", "Ledger entry ZZZZZ9999Z."]])
+    stats = ee.process_pdf_incremental(pdf_path, csv_path, str(tmp_path / "cache"), ner=False)
+    assert stats["relinked_pages"] == 1
+    assert read_links(csv_path) == {"ABCDE1234F": "Ravi Kumar", "ZZZZZ9999Z": "Not Found"}
+
+def test_stream_and_whole_text_agree_on_page_numbers():
+    pages = [f"Page {n} " + "x" * (23 * n % 90) + f" ABCDE{n:04d}F tail " + "y" * (41 * n % 70) for n in range(1, 12)]
+    document = ee.PdfText("\n".join(pages) + "\n", ee.build_page_offsets(pages))
+    whole = {pan: [occurrence.page for occurrence in mentions]
+             for pan, mentions in ee.build_pan_index(document.text, document.page_offsets).items()}
+    streamed = {}
+    for window in ee.iter_text_windows(pages, overlap=40):
+        positions = ee.find_pan_positions(window.text, window.start, window.end, (), window.page_offsets,
+                                          window.first_page)
+        for pan, mentions in positions.items():
+            streamed.setdefault(pan, []).extend(occurrence.page for occurrence in mentions)
+    assert whole == streamed == {f"ABCDE{n:04d}F": [n] for n in range(1, 12)}
+
+def test_nearest_entity_window_bounds_and_ties():
+    span = ee.EntitySpan
+    index = ee.EntityIndex([span("Ravi", "PERSON", 60, 64), span("Ravi Kumar", "PERSON", 60, 70),
+                            span("Globex Ltd", "ORG", 125, 135), span("Delhi", "GPE", 95, 100),
+                            span("Co", "ORG", 112, 114)])
+    assert len(index) == 3
+    # PAN at [100, 110): the organisation after it is 15 characters away, the person before 30
+    assert ee.find_nearest_entity(index, 100, 110) == ("Globex Ltd", "Organisation")
+    assert ee.find_nearest_entity(index, 100, 110, bounds=(0, 130)) == ("Ravi Kumar", "Person")
+    assert ee.find_nearest_entity(index, 100, 110, bounds=(65, 130)) == (None, None)
+    # The window reaches any entity it overlaps, and nothing it does not
+    assert ee.find_nearest_entity(index, 100, 110, window=16) == ("Globex Ltd", "Organisation")
+    assert ee.find_nearest_entity(index, 100, 110, window=15) == (None, None)
+    # Equal gaps go to the entity before the PAN
+    assert ee.find_nearest_entity(index, 85, 110) == ("Ravi Kumar", "Person")
+
+def test_counterparty_matcher_finds_overlapping_and_suffix_names():
+    matcher = ee.CounterpartyMatcher([("Globex Trading Ltd", "ORG"), ("Trading Ltd", "ORG"), ("Globex", "ORG"),
+                                      ("Ravi Kumar", "PERSON"), ("globex", "ORG"), ("Trading Co", "ORG")])
+    assert len(matcher) == 5
+    text = "Paid Globex Globex Trading, Ltd. and Mr RAVI  KUMAR; Trading Cox"
+    found = [(span.text, text[span.start:span.end]) for span in matcher.find_all(text)]
+    assert found == [("Globex", "Globex"), ("Globex", "Globex"), ("Globex Trading Ltd", "Globex Trading, Ltd"),
+                     ("Trading Ltd", "Trading, Ltd"), ("Ravi Kumar", "RAVI  KUMAR")]
+
+def test_pattern_only_mode_never_imports_spacy(tmp_path):
+    pdf_path = str(tmp_path / "ledger.pdf")
+    benchmark.write_pdf(pdf_path, [["PAN: ABCDE1234F of Mr. Ravi Kumar.", "Ravi Kumar ZZZZZ9999Z"]])
+    probe = ("import sys, extract_entities as ee; pdf, out = sys.argv[1:]; "
+             "ee.main([pdf, '--no-ner', '--cache-dir', '', '-o', out]); "
+             "extractor = ee.Extractor(ner=False); extractor.extract(pdf); list(extractor.stream(pdf)); "
+             "ee.process_pdf_batch([pdf, pdf], out, ner=False); "
+             "print('spacy' in sys.modules)")
+    output = subprocess.run([sys.executable, "-c", probe, pdf_path, str(tmp_path / "out.csv")],
+                            cwd=os.path.dirname(os.path.abspath(ee.__file__)),
+                            capture_output=True, text=True, check=True).stdout
+    assert output.splitlines()[-1] == "False"
+    assert read_links(str(tmp_path / "out.csv")) == {"ABCDE1234F": "Ravi Kumar", "ZZZZZ9999Z": "Not Found"}
+
+def test_ner_escalates_only_for_unresolved_pans(blank_nlp):
+    text = escalation_text()
+    metrics = ee.ExtractionMetrics()
+    links = ee.link_pans(text, ee.build_pan_index(text), blank_nlp, metrics=metrics)
+    assert links == {"ABCDE1234F": ("Ravi Kumar", "Person"), "PQRST5678Z": ("Sunil Rao", "Person"),
+                     "LMNOP1234Q": ("Anil Mehta", "Person")}
+    # Own line for the first, neighbouring line for the second, a context window for the third
+    assert metrics.counters["ner_hits"] == 1 and metrics.counters["ner_broader_window_hits"] == 2
+    assert metrics.counters["ner_escalations"] == 2 + 1
+    assert metrics.counters["spacy_chars_processed"] < len(text)
+
+def test_mentions_past_the_per_pan_limit_are_not_searched(blank_nlp):
+    filler = "\n".join(["settled against the ledger balance."] * 15)
+
+    def ledger(named_mention):
+        lines = [f"{'Ravi Kumar' if n == named_mention else 'entry'} ABCDE1234F" for n in range(1, 30)]
+        return "\n".join(f"{line}\n{filler}" for line in lines)
+
+    for named_mention, expected in ((ee.MAX_MENTIONS_PER_PAN, "Ravi Kumar"), (ee.MAX_MENTIONS_PER_PAN + 1, None)):
+        text = ledger(named_mention)
+        links = ee.link_pans(text, ee.build_pan_index(text), blank_nlp)
+        assert links.get("ABCDE1234F", (None, None))[0] == expected
+
+def test_line_index_span():
+    lines = ee.LineIndex("ab\ncd\n\nef")
+    assert lines.span(0, 1) == (0, 2)
+    assert lines.span(3, 5) == (3, 5)
+    assert lines.span(3, 3) == (3, 5)
+    assert lines.span(1, 4) == (0, 5)
+    assert lines.span(2, 3) == (0, 2)
+    assert lines.span(7, 9) == (7, 9)
+    assert lines.span(4, 5, radius=1) == (0, 6)
+    assert lines.span(3, 4, radius=5) == (0, 9)
+    assert ee.LineIndex("ab\n").span(3, 3) == (3, 3)
+
+def test_pdfium_pages_are_closed_on_early_stop_and_errors(monkeypatch):
+    closed = []
+
+    class Closable:
+        def __init__(self, name):
+            self.name = name
+
+        def close(self):
+            closed.append(self.name)
+
+    class Page(Closable):
+        def get_textpage(self):
+            return TextPage(f"text {self.name}")
+
+    class TextPage(Closable):
+        def get_text_range(self):
+            if self.name == "text 2":
+                raise ValueError("broken text layer")
+            return "line\r\n"
+
+    class PdfDocument(Closable):
+        def __init__(self, path):
+            super().__init__("document")
+
+        def __len__(self):
+            return 3
+
+        def __getitem__(self, i):
+            return Page(str(i))
+
+    monkeypatch.setitem(sys.modules, "pypdfium2", type(sys)("pypdfium2"))
+    monkeypatch.setattr(sys.modules["pypdfium2"], "PdfDocument", PdfDocument, raising=False)
+    pages = ee.PdfiumBackend().iter_pages("statement.pdf")
+    assert next(pages) == "line\n"
+    pages.close()
+    assert closed == ["text 0", "0", "document"]
+
+    closed.clear()
+    with pytest.raises(ValueError):
+        list(ee.PdfiumBackend().iter_pages("statement.pdf", start=2))
+    assert closed == ["text 2", "2", "document"]